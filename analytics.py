@@ -0,0 +1,321 @@
+"""Optional in-memory column store for transaction analytics.
+
+Enabled with ANALYTICS=1 when numpy is installed. The transactions
+columns are kept as numpy arrays sorted by date: a date range is two
+binary searches and every aggregate is a vectorized reduction over that
+slice. A background task loads new rows every ANALYTICS_REFRESH_INTERVAL
+seconds, so answers trail the database by up to that long. Archived
+months are loaded once from their files.
+
+Ids are handed out at insert but become visible at commit, so on
+Postgres a lower id can show up after a higher one was loaded. Each
+refresh re-reads the last ANALYTICS_ID_WINDOW ids below the highest one
+seen and skips those already loaded.
+"""
+import asyncio
+import datetime
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import select
+
+from db import async_stream_session
+from models.archive import ArchivedMonth
+from models.transaction import PERCENTILES, Transaction
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ANALYTICS = os.environ.get("ANALYTICS") == "1" and np is not None
+ANALYTICS_REFRESH_INTERVAL = float(os.environ.get("ANALYTICS_REFRESH_INTERVAL", "5"))
+ANALYTICS_BATCH = int(os.environ.get("ANALYTICS_BATCH", "100000"))
+ANALYTICS_ID_WINDOW = int(os.environ.get("ANALYTICS_ID_WINDOW", "1000"))
+COLUMNS = ("station_id", "fuel_type", "date", "fuel_quantity", "price")
+DTYPES = {"station_id": "int32", "fuel_type": "int32", "date": "int64", "fuel_quantity": "float64", "price": "float64"}
+HOUR_US = 3600 * 10**6
+DAY_US = 24 * HOUR_US
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_us(value: datetime.datetime) -> int:
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_us(value: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+def bucket_starts(dates, size: str):
+    """bucket_floor() over an array of microsecond timestamps."""
+    if size == "hour":
+        return dates - dates % HOUR_US
+    days = dates // DAY_US
+    if size == "week":
+        # 1970-01-01 was a Thursday, weekday() 3.
+        days = days - (days + 3) % 7
+    return days * DAY_US
+
+
+# pylint: disable=C0115,C0116,W0718
+class TransactionAnalytics:
+    def __init__(self, refresh_interval: float = ANALYTICS_REFRESH_INTERVAL, id_window: int = ANALYTICS_ID_WINDOW):
+        self.refresh_interval = refresh_interval
+        self.id_window = id_window
+        self.last_id = 0
+        # Loaded ids within id_window of last_id.
+        self._recent_ids: set[int] = set()
+        self.refreshes = 0
+        self.last_refresh_rows = 0
+        self.last_refresh_ms = 0.0
+        self.refresh_total_ms = 0.0
+        # Arrays with spare capacity and the number of rows in use, kept
+        # in one tuple so a query always sees a matching pair.
+        self._state = ({name: np.empty(0, DTYPES[name]) for name in COLUMNS} if np is not None else {}, 0)
+        self._archived_loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def stats(self) -> dict:
+        buffers, size = self._state
+        return {
+            "rows": size,
+            "last_id": self.last_id,
+            "memory_bytes": int(sum(column.nbytes for column in buffers.values())),
+            "refreshes": self.refreshes,
+            "last_refresh_rows": self.last_refresh_rows,
+            "last_refresh_ms": self.last_refresh_ms,
+            "refresh_total_ms": self.refresh_total_ms,
+        }
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refresh analytics: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self) -> int:
+        """Loads archived months once, then transactions not loaded yet."""
+        start = time.perf_counter()
+        chunks = []
+        async with async_stream_session() as session, session.begin():
+            if not self._archived_loaded:
+                months = await ArchivedMonth.overlapping(session)
+                archived = list(ArchivedMonth.scan(months))
+                if archived:
+                    rows = [[row[name] for name in COLUMNS] for row in archived]
+                    chunks.append(await asyncio.to_thread(self._to_arrays, rows))
+                self._archived_loaded = True
+            query = (
+                select(Transaction.id, *[getattr(Transaction, name) for name in COLUMNS])
+                .where(Transaction.id > self.last_id - self.id_window)
+                .order_by(Transaction.id)
+                .execution_options(yield_per=ANALYTICS_BATCH)
+            )
+            result = await session.stream(query)
+            async for rows in result.partitions():
+                rows = [row for row in rows if row[0] not in self._recent_ids]
+                if not rows:
+                    continue
+                self.last_id = max(self.last_id, rows[-1][0])
+                floor = self.last_id - self.id_window
+                self._recent_ids = {id for id in self._recent_ids if id > floor}
+                self._recent_ids.update(row[0] for row in rows if row[0] > floor)
+                chunks.append(await asyncio.to_thread(self._to_arrays, [row[1:] for row in rows]))
+        rows = sum(len(chunk["date"]) for chunk in chunks)
+        if chunks:
+            # Off the event loop, a full re-sort can take a while.
+            await asyncio.to_thread(self._merge, chunks)
+        self.refreshes += 1
+        self.last_refresh_rows = rows
+        self.last_refresh_ms = (time.perf_counter() - start) * 1000
+        self.refresh_total_ms += self.last_refresh_ms
+        return rows
+
+    def _to_arrays(self, rows: list) -> dict:
+        values = list(zip(*rows))
+        arrays = {}
+        for index, name in enumerate(COLUMNS):
+            if name == "date":
+                arrays[name] = np.array(values[index], dtype="datetime64[us]").astype("int64")
+            else:
+                arrays[name] = np.array(values[index], dtype=DTYPES[name])
+        return arrays
+
+    def _columns(self) -> dict:
+        buffers, size = self._state
+        return {name: column[:size] for name, column in buffers.items()}
+
+    def _merge(self, chunks: list[dict]):
+        buffers, size = self._state
+        added = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}
+        count = len(added["date"])
+        dates = np.concatenate([buffers["date"][size - 1:size], added["date"]])
+        if np.all(np.diff(dates) >= 0):
+            # New sales are later than everything loaded: append in place.
+            # Rows past size are invisible to queries until _state moves.
+            if size + count > len(buffers["date"]):
+                capacity = max(2 * len(buffers["date"]), size + count, 1024)
+                grown = {}
+                for name, column in buffers.items():
+                    grown[name] = np.empty(capacity, DTYPES[name])
+                    grown[name][:size] = column[:size]
+                buffers = grown
+            for name in COLUMNS:
+                buffers[name][size:size + count] = added[name]
+            self._state = (buffers, size + count)
+            return
+        # Back-dated rows (add_batch with a date, archives): sort again.
+        # The data is almost sorted, which the stable sort handles fast.
+        merged = {name: np.concatenate([buffers[name][:size], added[name]]) for name in COLUMNS}
+        order = np.argsort(merged["date"], kind="stable")
+        self._state = ({name: column[order] for name, column in merged.items()}, size + count)
+
+    def _select(
+        self,
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> dict:
+        columns = self._columns()
+        dates = columns["date"]
+        lower = 0 if date_from is None else int(np.searchsorted(dates, to_us(date_from), "left"))
+        upper = len(dates) if date_to is None else int(np.searchsorted(dates, to_us(date_to), "right"))
+        selected = {name: column[lower:upper] for name, column in columns.items()}
+        mask = None
+        if station_ids:
+            mask = np.isin(selected["station_id"], station_ids)
+        if fuel_types:
+            fuel_mask = np.isin(selected["fuel_type"], fuel_types)
+            mask = fuel_mask if mask is None else mask & fuel_mask
+        if mask is not None:
+            selected = {name: column[mask] for name, column in selected.items()}
+        return selected
+
+    def totals(
+        self,
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> dict:
+        selected = self._select(None if station_id is None else [station_id], None, date_from, date_to)
+        return {
+            "fuel": float(selected["fuel_quantity"].sum()),
+            "revenue": float(selected["price"].sum()),
+            "count": int(len(selected["price"])),
+        }
+
+    def summary(
+        self,
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> dict:
+        selected = self._select(None if station_id is None else [station_id], None, date_from, date_to)
+        prices = selected["price"]
+        data = {
+            "count": int(len(prices)),
+            "fuel": float(selected["fuel_quantity"].sum()),
+            "revenue": float(prices.sum()),
+            "avg_price": float(prices.mean()) if len(prices) else None,
+        }
+        values = np.percentile(prices, [q * 100 for q in PERCENTILES.values()]) if len(prices) else None
+        for index, name in enumerate(PERCENTILES):
+            data[name] = None if values is None else float(values[index])
+        return data
+
+    def series(
+        self,
+        bucket: str = "day",
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> list[tuple]:
+        """Transaction.get_series() rows."""
+        selected = self._select(station_ids, fuel_types, date_from, date_to)
+        # Bucket starts are whole hours, so station and hour number pack
+        # into one int64 key and the group-by is a 1-D unique.
+        hours = bucket_starts(selected["date"], bucket) // HOUR_US
+        keys = (selected["station_id"].astype("int64") << 32) | hours
+        groups, inverse = np.unique(keys, return_inverse=True)
+        fuel = np.bincount(inverse, selected["fuel_quantity"], len(groups))
+        revenue = np.bincount(inverse, selected["price"], len(groups))
+        count = np.bincount(inverse, minlength=len(groups))
+        return [
+            (
+                int(key >> 32),
+                from_us((key & 0xFFFFFFFF) * HOUR_US),
+                float(fuel[i]),
+                float(revenue[i]),
+                int(count[i]),
+                float(revenue[i] / count[i]),
+            )
+            for i, key in enumerate(groups.tolist())
+        ]
+
+    def group_by(
+        self,
+        by: str,
+        column: str = "price",
+        percentiles: Optional[list[float]] = None,
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> list[dict]:
+        """Count, totals and percentiles of column per station_id or fuel_type."""
+        selected = self._select(station_ids, fuel_types, date_from, date_to)
+        percentiles = list(PERCENTILES.values()) if percentiles is None else percentiles
+        if not len(selected[by]):
+            return []
+        # Sort by group, then value: each group is a sorted run of values.
+        order = np.lexsort((selected[column], selected[by]))
+        values = selected[column][order]
+        keys, starts, counts = np.unique(selected[by][order], return_index=True, return_counts=True)
+        fuel = np.add.reduceat(selected["fuel_quantity"][order], starts)
+        revenue = np.add.reduceat(selected["price"][order], starts)
+        averages = np.add.reduceat(values, starts) / counts
+        quantiles = []
+        for q in percentiles:
+            position = q * (counts - 1)
+            lower = np.floor(position).astype("int64")
+            upper = np.minimum(lower + 1, counts - 1)
+            low_values = values[starts + lower]
+            quantiles.append(low_values + (values[starts + upper] - low_values) * (position - lower))
+        return [
+            {
+                by: int(key),
+                "count": int(counts[i]),
+                "fuel": float(fuel[i]),
+                "revenue": float(revenue[i]),
+                "avg": float(averages[i]),
+                "percentiles": {str(q): float(quantile[i]) for q, quantile in zip(percentiles, quantiles)},
+            }
+            for i, key in enumerate(keys)
+        ]
+
+
+transaction_analytics = TransactionAnalytics()
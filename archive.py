@@ -0,0 +1,128 @@
+"""Moves closed months of transactions to gzipped columnar files.
+
+    python main.py archive
+
+Months that ended more than ARCHIVE_AFTER_MONTHS ago are written to
+ARCHIVE_DIR as row groups (see models.archive) and removed from the
+database. Their hourly_rollups stay, and the stats queries read the
+archived rows they still need through ArchivedMonth.scan().
+"""
+import datetime
+import gzip
+import os
+import shutil
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from migrations import ensure_partitions, is_partitioned, partition_name
+from models.archive import (
+    ArchivedMonth,
+    ArchivedStats,
+    add_months,
+    archive_path,
+    archived_stats,
+    month_floor,
+    write_row_group,
+)
+from models.transaction import EXPORT_COLUMNS, Transaction
+
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("ARCHIVE_AFTER_MONTHS", "3"))
+ARCHIVE_ROW_GROUP = int(os.environ.get("ARCHIVE_ROW_GROUP", "100000"))
+
+
+async def archive_month(engine: AsyncEngine, month: datetime.datetime) -> int:
+    """Archives one month and returns the number of rows moved.
+
+    Archiving a month again writes a new file with the old file's rows
+    and the new ones. ArchivedMonth.path moves to it in the transaction
+    that deletes the rows, and the old file is removed once that commits.
+    """
+    month = month_floor(month)
+    month_end = add_months(month, 1)
+    archived_at = datetime.datetime.now()
+    path = archive_path(month, archived_at)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    in_month = (Transaction.date >= month) & (Transaction.date < month_end)
+    query = (
+        select(*[getattr(Transaction, column) for column in EXPORT_COLUMNS])
+        .where(in_month)
+        .order_by(Transaction.date, Transaction.id)
+        .execution_options(yield_per=ARCHIVE_ROW_GROUP)
+    )
+
+    try:
+        async with engine.begin() as conn:
+            partition = None
+            if conn.dialect.name == "postgresql" and await conn.run_sync(is_partitioned):
+                partition = partition_name(month)
+                exists = await conn.exec_driver_sql(f"SELECT to_regclass('{partition}')")
+                if exists.scalar() is None:
+                    partition = None
+                else:
+                    # Keeps late sales for this month out until it is dropped.
+                    await conn.exec_driver_sql(f"LOCK TABLE {partition} IN EXCLUSIVE MODE")
+            previous = (
+                await conn.execute(select(ArchivedMonth).where(ArchivedMonth.month == month))
+            ).first()
+
+            rows = 0
+            max_id = None
+            sales = {}
+            with gzip.open(path, "wb") as file:
+                if previous is not None:
+                    with gzip.open(previous.path, "rb") as old_file:
+                        shutil.copyfileobj(old_file, file)
+                result = await conn.stream(query)
+                async for group in result.partitions():
+                    write_row_group(file, EXPORT_COLUMNS, group)
+                    rows += len(group)
+                    max_id = max([max_id or 0] + [row.id for row in group])
+                    for row in group:
+                        sales.setdefault(row.station_id, []).append((row.price, row.fuel_quantity))
+            if not rows:
+                os.remove(path)
+                return 0
+
+            if partition is not None:
+                await conn.exec_driver_sql(f"DROP TABLE {partition}")
+            # Without a partition to drop, rows added since the export are
+            # left in place; they stay visible and the next run archives them.
+            await conn.execute(delete(Transaction).where(in_month, Transaction.id <= max_id))
+            await conn.execute(delete(ArchivedMonth).where(ArchivedMonth.month == month))
+            await conn.execute(
+                insert(ArchivedMonth).values(
+                    month=month,
+                    month_end=month_end,
+                    path=path,
+                    rows=rows + (previous.rows if previous is not None else 0),
+                    archived_at=archived_at,
+                )
+            )
+            await conn.execute(insert(ArchivedStats), archived_stats(month, sales))
+    except Exception:
+        # The rows are still live and ArchivedMonth points at the old file.
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    if previous is not None and previous.path != path and os.path.exists(previous.path):
+        os.remove(previous.path)
+    return rows
+
+
+async def archive_closed_months(engine: AsyncEngine) -> dict:
+    now = datetime.datetime.now()
+    cutoff = add_months(month_floor(now), -ARCHIVE_AFTER_MONTHS)
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql" and await conn.run_sync(is_partitioned):
+            await conn.run_sync(ensure_partitions, now, now)
+        first = (await conn.execute(select(func.min(Transaction.date)).where(Transaction.date < cutoff))).scalar()
+
+    archived = {}
+    month = None if first is None else month_floor(first)
+    while month is not None and month < cutoff:
+        rows = await archive_month(engine, month)
+        if rows:
+            archived[f"{month:%Y-%m}"] = rows
+        month = add_months(month, 1)
+    return archived
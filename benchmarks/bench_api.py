@@ -0,0 +1,172 @@
+"""In-process load test of the API hot paths with a regression gate.
+
+    python -m benchmarks.bench_api --save            # record a baseline
+    python -m benchmarks.bench_api --threshold 0.2   # compare against it
+
+Starts service.app with its lifespan against a temporary SQLite file,
+seeds it, then drives each scenario with a fixed number of concurrent
+httpx clients over ASGITransport. Throughput and p50/p95/p99 latency
+are written to --output. With a baseline present the run exits with
+status 1 when a scenario loses more than --threshold of its throughput
+or its p95 grows by more than --threshold.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import atexit
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+DIRECTORY = tempfile.mkdtemp(prefix="bench_api_")
+atexit.register(shutil.rmtree, DIRECTORY, ignore_errors=True)
+# db.py reads these on import and load_dotenv() does not override them.
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(DIRECTORY, 'bench.sqlite3')}"
+os.environ["DEBUG"] = "0"
+# Reopens then run during transactions_add, not in the scenarios after it.
+os.environ["REOPEN_DELAY"] = "0"
+
+# pylint: disable=C0413
+import httpx
+
+from service import app, init_routes
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+STATIONS = (1, 2, 3, 4)
+
+
+def scenarios(rng: random.Random, stations: int) -> dict:
+    now = datetime.datetime.now()
+    # A station closes after each sale, so every sale gets its own one.
+    sale_stations = itertools.cycle(range(1, stations + 1))
+    window = {"date_from": (now - datetime.timedelta(days=1)).isoformat(), "date_to": now.isoformat()}
+    return {
+        "transactions_add": lambda: (
+            "POST",
+            "/transactions/add",
+            {"number": f"number {rng.randint(1, 50)}", "fuel_quantity": rng.randint(10, 50), "station_id": next(sale_stations)},
+            (200,),
+        ),
+        "stations_get_by_id": lambda: ("GET", f"/stations/get_by_id/{rng.choice(STATIONS)}", None, (200,)),
+        "transactions_get_all": lambda: ("GET", "/transactions/get_all", None, (200,)),
+        "stats_get_all_fuel": lambda: (
+            "POST",
+            "/stats/get_all_fuel",
+            {"station_id": rng.choice(STATIONS), **window},
+            (200,),
+        ),
+        "stats_get_summary": lambda: ("POST", "/stats/get_summary", {"station_id": rng.choice(STATIONS)}, (200,)),
+    }
+
+
+async def seed(client: httpx.AsyncClient, transactions: int, stations: int, rng: random.Random):
+    for _ in range(stations - len(STATIONS)):
+        response = await client.post("/stations/add", json={"fuel_type": rng.choice(STATIONS)})
+        response.raise_for_status()
+    for offset in range(0, transactions, 1000):
+        batch = [
+            {"number": f"seed {rng.randint(1, 500)}", "fuel_quantity": rng.randint(10, 50), "station_id": rng.choice(STATIONS)}
+            for _ in range(min(1000, transactions - offset))
+        ]
+        response = await client.post("/transactions/add_batch", json={"transactions": batch})
+        response.raise_for_status()
+
+
+async def run_scenario(client: httpx.AsyncClient, make_request, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, body, ok_statuses = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in ok_statuses:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            found.append(f"{name}: throughput {result['throughput']:.0f} < baseline {base['throughput']:.0f}")
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            found.append(f"{name}: p95 {result['p95_ms']:.2f} ms > baseline {base['p95_ms']:.2f} ms")
+    return found
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--transactions", type=int, default=20000, help="sales seeded before the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--output", default=None, help="defaults to --baseline with --save")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    init_routes()
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            stations = max(args.requests, len(STATIONS))
+            await seed(client, args.transactions, stations, rng)
+            for name, make_request in scenarios(rng, stations).items():
+                results[name] = await run_scenario(client, make_request, args.requests, args.concurrency)
+
+    print(f"{'scenario':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<24}{result['throughput']:>10.0f}{result['p50_ms']:>10.2f}"
+            f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['errors']:>8}"
+        )
+
+    output = args.output or (args.baseline if args.save else None)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"results written to {output}")
+    failed = [name for name, result in results.items() if result["errors"]]
+    for name in failed:
+        print(f"ERRORS {name}: {results[name]['errors']} unexpected responses")
+    found = []
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            found = regressions(results, json.load(file), args.threshold)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,121 @@
+"""Times the transactions filter queries before and after the index migration.
+
+    python -m benchmarks.bench_indexes --rows 2000000
+
+Seeds a temporary SQLite file, runs every query without the indexes,
+applies the migration step to the populated table and runs them again.
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select, text
+
+from db import Base
+from migrations import create_transaction_indexes
+from models.transaction import Transaction
+
+STATIONS = 50
+FUEL_TYPES = 4
+START = datetime.datetime(2023, 1, 1)
+SPAN = datetime.timedelta(days=365)
+
+
+def seed(conn, rows: int, rng: random.Random, batch_size: int = 50000):
+    table = Transaction.__table__
+    seconds = SPAN.total_seconds()
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for _ in range(min(batch_size, rows - offset)):
+            quantity = rng.randint(10, 50)
+            fuel_type = rng.randint(1, FUEL_TYPES)
+            batch.append(
+                {
+                    "number": f"{rng.randint(0, 999):03d}ABC",
+                    "fuel_quantity": quantity,
+                    "fuel_type": fuel_type,
+                    "price": quantity * (40 + 5 * fuel_type),
+                    "date": START + datetime.timedelta(seconds=rng.random() * seconds),
+                    "station_id": rng.randint(1, STATIONS),
+                }
+            )
+        conn.execute(table.insert(), batch)
+
+
+def queries():
+    week_from = START + datetime.timedelta(days=100)
+    week_to = week_from + datetime.timedelta(days=7)
+    day_to = week_from + datetime.timedelta(days=1)
+    return {
+        "station_date_sum": select(func.sum(Transaction.fuel_quantity))
+        .where(Transaction.station_id == 7)
+        .where(Transaction.date >= week_from)
+        .where(Transaction.date <= week_to),
+        "fuel_date_sum": select(func.sum(Transaction.price))
+        .where(Transaction.fuel_type == 2)
+        .where(Transaction.date >= week_from)
+        .where(Transaction.date <= week_to),
+        "date_range_count": select(func.count(Transaction.id))
+        .where(Transaction.date >= week_from)
+        .where(Transaction.date <= day_to),
+        "number_lookup": select(Transaction.id).where(Transaction.number == "042ABC").limit(100),
+        "station_page": select(Transaction.id)
+        .where(Transaction.station_id == 7)
+        .order_by(Transaction.id.desc())
+        .limit(100),
+    }
+
+
+def time_queries(conn, repeat: int) -> dict[str, float]:
+    timings = {}
+    for name, query in queries().items():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(query).all()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.sqlite3')}")
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            for index in Transaction.__table__.indexes:
+                conn.execute(text(f"DROP INDEX {index.name}"))
+            start = time.perf_counter()
+            seed(conn, args.rows, random.Random(args.seed))
+            print(f"seeded {args.rows} rows in {time.perf_counter() - start:.1f} s")
+
+        with engine.connect() as conn:
+            before = time_queries(conn, args.repeat)
+        with engine.begin() as conn:
+            start = time.perf_counter()
+            create_transaction_indexes(conn)
+            print(f"migration built indexes in {time.perf_counter() - start:.1f} s")
+            rows = conn.execute(select(func.count(Transaction.id))).scalar()
+            assert rows == args.rows, "migration lost rows"
+        with engine.connect() as conn:
+            after = time_queries(conn, args.repeat)
+        engine.dispose()
+
+    print(f"{'query':<20}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name, before_ms in before.items():
+        after_ms = after[name]
+        print(f"{name:<20}{before_ms:>12.2f}{after_ms:>12.2f}{before_ms / after_ms:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Per-row CPU cost of the list response paths.
+
+    python -m benchmarks.bench_serialization --rows 1000
+
+"schema" is the old /transactions/get_all path: ORM objects, one
+TransactionSchema per row, TransactionsResponse, then FastAPI's
+response_model validation and JSON encoding. "rows" is
+responses.rows_response over plain SQL row tuples. Both bodies are
+checked to decode to the same JSON.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from fastapi.responses import JSONResponse
+
+from models.transaction import EXPORT_COLUMNS, Transaction
+from responses import rows_response
+from routes.transaction import TransactionsResponse
+
+
+def make_rows(count: int) -> list[tuple]:
+    start = datetime.datetime(2024, 3, 8, 12, 0, 0, 123456)
+    return [
+        (i, f"{i % 1000:03d}ABC", float(10 + i % 40), 1 + i % 4, 45.0 * (10 + i % 40),
+         start + datetime.timedelta(seconds=i), 1 + i % 8)
+        for i in range(1, count + 1)
+    ]
+
+
+async def schema_path(field, rows: list[tuple]) -> bytes:
+    transactions = [Transaction(**dict(zip(EXPORT_COLUMNS, row))) for row in rows]
+    content = TransactionsResponse(code=200, value=Transaction.from_list_to_schema(transactions))
+    body = await serialize_response(field=field, response_content=content)
+    return JSONResponse(body).body
+
+
+def rows_path(rows: list[tuple]) -> bytes:
+    return rows_response(EXPORT_COLUMNS, rows).body
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    field = create_response_field(name="response", type_=TransactionsResponse)
+    rows = make_rows(args.rows)
+    assert json.loads(await schema_path(field, rows)) == json.loads(rows_path(rows))
+
+    start = time.process_time()
+    for _ in range(args.repeat):
+        await schema_path(field, rows)
+    schema_us = (time.process_time() - start) / (args.repeat * args.rows) * 1e6
+
+    start = time.process_time()
+    for _ in range(args.repeat):
+        rows_path(rows)
+    rows_us = (time.process_time() - start) / (args.repeat * args.rows) * 1e6
+
+    print(f"{'path':<8}{'us/row':>10}")
+    print(f"{'schema':<8}{schema_us:>10.2f}")
+    print(f"{'rows':<8}{rows_us:>10.2f}")
+    print(f"saved {schema_us - rows_us:.2f} us/row ({schema_us / rows_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Compares sale write throughput with and without the SQLite profile.
+
+    python -m benchmarks.bench_sqlite_writes --workers 32 --sales 100
+
+"default" is a plain create_async_engine() as the app used before:
+rollback journal and a new connection per session. "tuned" is
+db.create_engine_from_env(): WAL, the pragmas and one writer connection.
+Each worker stores single sales through Transaction.add_batch, so every
+sale is an insert, a station update, a rollup upsert and a commit.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import Base, create_engine_from_env
+from models.fuel_type import FuelType
+from models.station import Station
+from models.transaction import Transaction
+
+STATIONS = 20
+
+
+async def prepare(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(FuelType), [{"fuel_name": f"fuel {i}", "price": 40 + i} for i in range(4)])
+        await conn.execute(
+            insert(Station),
+            [{"fuel_type": 1 + i % 4, "fuel_quantity": 10 ** 9, "status": True} for i in range(STATIONS)],
+        )
+
+
+async def worker(session_factory, sales: int, rng: random.Random, counters: dict):
+    for _ in range(sales):
+        sale = {"number": "BENCH", "fuel_quantity": rng.randint(10, 50), "station_id": rng.randint(1, STATIONS)}
+        async with session_factory() as session:
+            result = await Transaction.add_batch(session, [sale])
+        if result.is_error or result.value[0][0] != 200:
+            counters["errors"] += 1
+        else:
+            counters["ok"] += 1
+
+
+async def run_profile(name: str, workers: int, sales: int, seed: int):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.sqlite3')}"
+        if name == "tuned":
+            engine = create_engine_from_env(url)
+        else:
+            engine = create_async_engine(url)
+        await prepare(engine)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        counters = {"ok": 0, "errors": 0}
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[worker(session_factory, sales, random.Random(rng.random()), counters) for _ in range(workers)]
+        )
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+    print(f"{name:<8}{counters['ok'] / elapsed:>12.0f}{counters['ok']:>10}{counters['errors']:>10}{elapsed:>10.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--sales", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(f"{'profile':<8}{'sales/s':>12}{'ok':>10}{'errors':>10}{'seconds':>10}")
+    for name in ("default", "tuned"):
+        await run_profile(name, args.workers, args.sales, args.seed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+import asyncio
+import os
+from typing import AsyncIterator, Optional
+
+import orjson
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "100"))
+EVENT_KEEPALIVE = float(os.environ.get("EVENT_KEEPALIVE", "15"))
+
+
+# pylint: disable=C0115,C0116
+class Subscription:
+    __slots__ = ("queue", "station_ids", "dropped")
+
+    def __init__(self, queue_size: int, station_ids: Optional[set[int]]):
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.station_ids = station_ids
+        self.dropped = 0
+
+
+class BroadcastHub:
+    """In-process fan-out of change events to Server-Sent Events clients.
+
+    publish() encodes an event once and puts the same bytes on every
+    matching subscriber's queue without waiting. Queues hold queue_size
+    messages; when a slow client's queue is full its oldest message is
+    dropped, so one client never holds up the others or grows memory.
+    An idle subscriber is a queue and a suspended generator.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, keepalive: float = EVENT_KEEPALIVE):
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.published = 0
+        self.dropped = 0
+        self._subscriptions: set[Subscription] = set()
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "dropped": self.dropped,
+            "queue_size": self.queue_size,
+        }
+
+    def subscribe(self, station_ids: Optional[list[int]] = None) -> Subscription:
+        subscription = Subscription(self.queue_size, set(station_ids) if station_ids else None)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, name: str, data: dict):
+        self.published += 1
+        message = b"event: " + name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+        station_id = data["id"] if name == "station" else None
+        for subscription in self._subscriptions:
+            if station_id is not None and subscription.station_ids is not None and station_id not in subscription.station_ids:
+                continue
+            if subscription.queue.full():
+                subscription.queue.get_nowait()
+                subscription.dropped += 1
+                self.dropped += 1
+            subscription.queue.put_nowait(message)
+
+    async def stream(self, station_ids: Optional[list[int]] = None) -> AsyncIterator[bytes]:
+        # Subscribes on the first chunk, so a client that disconnects
+        # before the body starts leaves nothing behind.
+        subscription = self.subscribe(station_ids)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+hub = BroadcastHub()
+
+
+def queue_event(session: AsyncSession, name: str, data: dict):
+    """Publishes the event once the session's outermost transaction commits."""
+    session.info.setdefault("events", []).append((name, data))
+
+
+@event.listens_for(Session, "after_transaction_create")
+def mark_events(session: Session, transaction):
+    # Where a savepoint starts in the queue, to drop only its own events.
+    if transaction.nested:
+        session.info.setdefault("event_marks", {})[transaction] = len(session.info.get("events", ()))
+
+
+@event.listens_for(Session, "after_commit")
+def publish_events(session: Session):
+    # Also fires when a savepoint is released, its events wait for the
+    # outermost commit.
+    if session.get_nested_transaction() is not None:
+        return
+    session.info.pop("event_marks", None)
+    for name, data in session.info.pop("events", []):
+        hub.publish(name, data)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def drop_savepoint_events(session: Session, previous_transaction):
+    if previous_transaction.nested:
+        mark = session.info.get("event_marks", {}).pop(previous_transaction, 0)
+        del session.info.get("events", [])[mark:]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def drop_events(session: Session, transaction):
+    # Whatever the outermost transaction did not commit is dropped.
+    if transaction.parent is None:
+        session.info.pop("events", None)
+        session.info.pop("event_marks", None)
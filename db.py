@@ -1,9 +1,15 @@
 import os
+import time
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import instrument_engine
+from slow_queries import slow_query_log
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -31,13 +37,148 @@ dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-engine = create_async_engine(
-    os.environ.get("DATABASE_URL"), echo=os.environ.get("DEBUG") == "1"
-)
+DATABASE_URL = os.environ.get("DATABASE_URL")
+READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL")
+SQLITE_TUNING = os.environ.get("SQLITE_TUNING", "1") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", "5000")),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_KB", str(64 * 1024))),
+}
+
+
+# pylint: disable=C0115,C0116
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Counts checkouts and the time spent waiting for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+
+def is_tuned_sqlite(url: str) -> bool:
+    return SQLITE_TUNING and url.startswith("sqlite") and ":memory:" not in url
+
+
+def set_sqlite_pragmas(dbapi_connection, _, readonly: bool = False):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    if readonly:
+        cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+
+def create_engine_from_env(url: str = DATABASE_URL, readonly: bool = False) -> AsyncEngine:
+    """Builds an engine from the DB_* settings.
+
+    With the SQLite profile the write engine holds a single connection,
+    so writers queue in the pool instead of failing with "database is
+    locked", and the readonly engine keeps DB_READ_POOL_SIZE query_only
+    connections that read alongside it thanks to WAL.
+    """
+    options = {"echo": os.environ.get("DEBUG") == "1"}
+    if ":memory:" not in url:
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+            pool_pre_ping=os.environ.get("DB_POOL_PRE_PING") == "1",
+        )
+    tuned = is_tuned_sqlite(url)
+    if tuned and readonly:
+        options.update(pool_size=int(os.environ.get("DB_READ_POOL_SIZE", "5")), max_overflow=0)
+    elif tuned:
+        options.update(pool_size=1, max_overflow=0)
+    new_engine = create_async_engine(url, **options)
+    if tuned:
+        event.listen(
+            new_engine.sync_engine,
+            "connect",
+            lambda dbapi_connection, record: set_sqlite_pragmas(dbapi_connection, record, readonly),
+        )
+    return new_engine
+
+
+def pool_stats(async_engine: AsyncEngine) -> dict:
+    pool = async_engine.sync_engine.pool
+    stats = {
+        "checkouts": getattr(pool, "checkouts", 0),
+        "wait_total_ms": getattr(pool, "wait_total", 0.0) * 1000,
+        "wait_max_ms": getattr(pool, "wait_max", 0.0) * 1000,
+        "size": 0,
+        "checked_in": 0,
+        "checked_out": 0,
+        "overflow": 0,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return stats
+
+
+# Built at import because the models, jobs, CLI commands and tests bind
+# these and their session factories by name. Pools open connections on
+# first use, and a disposed engine reconnects if used again.
+engine = create_engine_from_env()
+if READ_DATABASE_URL:
+    read_engine = create_engine_from_env(READ_DATABASE_URL, readonly=True)
+elif is_tuned_sqlite(DATABASE_URL):
+    read_engine = create_engine_from_env(readonly=True)
+else:
+    read_engine = engine
+instrument_engine(engine, "write")
+slow_query_log.instrument(engine, "write")
+if read_engine is not engine:
+    instrument_engine(read_engine, "read")
+    slow_query_log.instrument(read_engine, "read")
 Base = declarative_base()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Reads run in autocommit, so there is no BEGIN/COMMIT around a SELECT
+# and nothing to commit or roll back when the session closes.
+async_read_session = sessionmaker(
+    read_engine.execution_options(isolation_level="AUTOCOMMIT"),
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+# Server-side cursors (session.stream with yield_per) only live inside a
+# transaction on asyncpg, so streamed reads open a read-only one.
+async_stream_session = sessionmaker(
+    read_engine.execution_options(postgresql_readonly=True),
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
 
 
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+async def get_read_session() -> AsyncSession:
+    """Session on read_engine, READ_DATABASE_URL if set, for GET routes.
+
+    Only pass it to methods that do not commit.
+    """
+    async with async_read_session() as session:
+        yield session
@@ -1,7 +1,31 @@
+import argparse
 import asyncio
-from service import run, init_models
+import datetime
+from archive import archive_closed_months
+from migrations import migrate
+from seed import seed_data
+from service import engine, run, backfill_rollups
 
 
 if __name__ == "__main__":
-    asyncio.run(init_models())
-    run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "migrate", "backfill_rollups", "seed", "archive"])
+    parser.add_argument("--stations", type=int, default=100, help="seed: stations to add")
+    parser.add_argument("--transactions", type=int, default=1000000, help="seed: transactions to add")
+    parser.add_argument("--seed", type=int, default=1, help="seed: random seed")
+    parser.add_argument("--days", type=int, default=365, help="seed: days of history")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, default=None, help="seed: last day, default today")
+    parser.add_argument("--batch-size", type=int, default=50000, help="seed: rows per insert batch")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        print(f"Applied migrations {asyncio.run(migrate(engine))}")
+    elif args.command == "backfill_rollups":
+        asyncio.run(backfill_rollups())
+    elif args.command == "archive":
+        print(f"Archived {asyncio.run(archive_closed_months(engine))}")
+    elif args.command == "seed":
+        print(asyncio.run(seed_data(
+            engine, args.stations, args.transactions, args.seed, args.days, args.end, args.batch_size
+        )))
+    else:
+        run()
@@ -0,0 +1,212 @@
+import asyncio
+import bisect
+import contextvars
+import os
+import time
+from typing import Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_HEADERS = os.environ.get("DEBUG") == "1"
+# [statements, seconds] of the request being served, see QueryCounterMiddleware.
+request_queries: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_queries", default=None)
+# "METHOD /path" of the request being served, for the slow query log.
+request_route: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_route", default=None)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames: Iterable[str], labels: Iterable) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labels)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# pylint: disable=C0115,C0116
+class Histogram:
+    """Prometheus histogram, observe() only bumps one bucket counter."""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.values.get(labels)
+        if series is None:
+            # One counter per bucket plus +Inf, then the sum.
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bounds = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+        for labels, series in self.values.items():
+            total = 0
+            for bound, count in zip(bounds, series):
+                total += count
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {total}")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {total}")
+        return lines
+
+
+def samples_text(
+    kind: str, name: str, help_text: str, samples: Iterable[tuple[tuple, float]], labelnames: tuple = ()
+) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labelnames, labels)} {value}")
+    return lines
+
+
+def gauge(name: str, help_text: str, samples: Iterable[tuple[tuple, float]], labelnames: tuple = ()) -> list[str]:
+    return samples_text("gauge", name, help_text, samples, labelnames)
+
+
+def counter(name: str, help_text: str, samples: Iterable[tuple[tuple, float]], labelnames: tuple = ()) -> list[str]:
+    return samples_text("counter", name, help_text, samples, labelnames)
+
+
+http_requests = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ("method", "route", "status"),
+)
+db_queries = Histogram(
+    "db_query_duration_seconds",
+    "Database statement latency by engine.",
+    ("engine",),
+)
+loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop in waking a sleeping task.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording http_requests per route template."""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: dict = {}
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                self._paths[getattr(route, "endpoint", None)] = getattr(route, "path", "unmatched")
+            path = self._paths.get(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests.observe(
+                (scope["method"], self._route_path(scope), status),
+                time.perf_counter() - start,
+            )
+
+
+class QueryCounterMiddleware:
+    """ASGI middleware counting the SQL statements run for each request.
+
+    Counts what runs in the request's own task, so sales handed to the
+    write buffer or reopens done by the scheduler are not included. With
+    headers on (DEBUG=1) the response carries X-DB-Queries and a
+    Server-Timing db entry with the total statement time.
+    """
+
+    def __init__(self, app, headers: bool = QUERY_HEADERS):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        route_token = request_route.set(f"{scope['method']} {scope['path']}")
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and self.headers:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(queries[0]).encode()))
+                headers.append(
+                    (b"server-timing", f'db;dur={queries[1] * 1000:.3f};desc="{queries[0]} queries"'.encode())
+                )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            request_queries.reset(token)
+            request_route.reset(route_token)
+
+
+def record_query(name: str, start: float):
+    elapsed = time.perf_counter() - start
+    db_queries.observe((name,), elapsed)
+    queries = request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += elapsed
+
+
+def instrument_engine(async_engine: AsyncEngine, name: str):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if starts:
+            record_query(name, starts.pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("metrics_query_start") if context.connection else None
+        if starts:
+            record_query(name, starts.pop())
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag.observe((), max(0.0, time.perf_counter() - start - interval))
+
+
+def render(extra: Optional[list[str]] = None) -> str:
+    lines = http_requests.render() + db_queries.render() + loop_lag.render() + (extra or [])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,221 @@
+import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, func, insert, inspect, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db import Base
+from models.archive import ArchivedMonth, ArchivedStats, add_months, archived_stats, month_floor
+from models.fuel_type import FuelType
+from models.station import Station
+from models.rollup import HourlyRollup
+from models.transaction import Transaction
+
+PARTITION_MONTHS_AHEAD = 2
+# price, fuel_name
+BASE_FUELS = [[43, "АИ-92"], [45, "АИ-95"], [47, "АИ-100"], [55, "Дизель"]]
+# Fuel in the first base station, each next one has 123 less.
+BASE_STATION_FUEL = 10000
+
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+def create_tables(conn: Connection):
+    Base.metadata.create_all(conn)
+
+
+def create_transaction_indexes(conn: Connection):
+    # create_all skips tables that already exist, so indexes added to a
+    # model later have to be created one by one.
+    for index in Transaction.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def create_archive_table(conn: Connection):
+    ArchivedMonth.__table__.create(conn, checkfirst=True)
+
+
+def create_archived_stats(conn: Connection):
+    """Adds archived_stats and fills it from months archived before it existed."""
+    ArchivedStats.__table__.create(conn, checkfirst=True)
+    for month in conn.execute(select(ArchivedMonth)).all():
+        if conn.execute(select(ArchivedStats.id).where(ArchivedStats.month == month.month).limit(1)).first():
+            continue
+        sales = {}
+        for row in ArchivedMonth.scan([month]):
+            sales.setdefault(row["station_id"], []).append((row["price"], row["fuel_quantity"]))
+        if sales:
+            conn.execute(insert(ArchivedStats), archived_stats(month.month, sales))
+
+
+def backfill_hourly_rollups(conn: Connection):
+    """Creates hourly_rollups if missing and fills it when it is empty.
+
+    Writes keep the table current, but a database whose sales predate it
+    would otherwise under-report every historic hour in totals and series.
+    """
+    HourlyRollup.__table__.create(conn, checkfirst=True)
+    if conn.execute(select(HourlyRollup.hour).limit(1)).first() is None:
+        conn.execute(Transaction.rollup_insert(conn.dialect.name))
+
+
+def add_station_reopen_at(conn: Connection):
+    """Adds stations.reopen_at, the reopen deadline a sale sets.
+
+    Stations closed before the column existed get a deadline that has
+    already passed, so the next startup reopens them as it used to.
+    """
+    if "reopen_at" not in {column["name"] for column in inspect(conn).get_columns("stations")}:
+        conn.exec_driver_sql("ALTER TABLE stations ADD COLUMN reopen_at TIMESTAMP")
+    conn.execute(
+        update(Station)
+        .where(Station.status.is_(False), Station.reopen_at.is_(None))
+        .values(reopen_at=datetime.datetime.now())
+    )
+
+
+def is_partitioned(conn: Connection) -> bool:
+    result = conn.exec_driver_sql("SELECT relkind FROM pg_class WHERE relname = 'transactions'")
+    return result.scalar() == "p"
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"transactions_y{month:%Y}m{month:%m}"
+
+
+def ensure_partitions(conn: Connection, start: datetime.datetime, end: datetime.datetime):
+    """Creates the monthly partitions from start's month to PARTITION_MONTHS_AHEAD past end's.
+
+    A month that already has rows in transactions_default cannot get
+    its own partition, so run this ahead of time (the archive job does).
+    """
+    month = month_floor(start)
+    last = add_months(month_floor(end), PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+        )
+        month = add_months(month, 1)
+
+
+def partition_transactions(conn: Connection):
+    """Rebuilds transactions as a table partitioned by month on Postgres.
+
+    Date filters then only scan the partitions of their months and the
+    archive job drops whole partitions. Other backends keep one table.
+    """
+    if conn.dialect.name != "postgresql" or is_partitioned(conn):
+        return
+    conn.exec_driver_sql("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    for index in Transaction.__table__.indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    conn.exec_driver_sql(
+        """
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            number VARCHAR,
+            fuel_quantity FLOAT,
+            fuel_type INTEGER REFERENCES fuel_types (id),
+            price FLOAT,
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            station_id INTEGER REFERENCES stations (id),
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+        """
+    )
+    conn.exec_driver_sql("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+    now = datetime.datetime.now()
+    first, last = conn.exec_driver_sql("SELECT min(date), max(date) FROM transactions_unpartitioned").one()
+    ensure_partitions(conn, min(first or now, now), max(last or now, now))
+    conn.exec_driver_sql(
+        "INSERT INTO transactions (id, number, fuel_quantity, fuel_type, price, date, station_id) "
+        "SELECT id, number, fuel_quantity, fuel_type, price, date, station_id FROM transactions_unpartitioned"
+    )
+    # The sequence belongs to the old table and would be dropped with it.
+    conn.exec_driver_sql("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    conn.exec_driver_sql("DROP TABLE transactions_unpartitioned")
+    for index in Transaction.__table__.indexes:
+        index.create(conn)
+
+
+# Append only: a database at version N gets every step after N, in order.
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "transaction indexes", create_transaction_indexes),
+    (3, "archived months table", create_archive_table),
+    (4, "partition transactions by month", partition_transactions),
+    (5, "archived month stats", create_archived_stats),
+    (6, "backfill hourly rollups", backfill_hourly_rollups),
+    (7, "station reopen deadlines", add_station_reopen_at),
+]
+
+
+def current_version(conn: Connection) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(conn: Connection) -> list[int]:
+    version = current_version(conn)
+    applied = []
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        step(conn)
+        conn.execute(
+            insert(schema_version).values(
+                version=step_version,
+                description=description,
+                applied_at=datetime.datetime.now(),
+            )
+        )
+        applied.append(step_version)
+    return applied
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    async with engine.begin() as conn:
+        return await conn.run_sync(upgrade)
+
+
+def seed_base_data(conn: Connection) -> bool:
+    """Adds the base fuel types and their stations to an empty database.
+
+    Does nothing once any fuel type exists, so restarts keep the data.
+    """
+    if conn.execute(select(FuelType.id).limit(1)).first() is not None:
+        return False
+    result = conn.execute(
+        insert(FuelType).returning(FuelType.id, sort_by_parameter_order=True),
+        [{"price": price, "fuel_name": name} for price, name in BASE_FUELS],
+    )
+    fuel_types = result.scalars().all()
+    if conn.execute(select(Station.id).limit(1)).first() is None:
+        conn.execute(
+            insert(Station),
+            [
+                {"fuel_type": fuel_type, "fuel_quantity": BASE_STATION_FUEL - 123 * index, "status": True}
+                for index, fuel_type in enumerate(fuel_types)
+            ],
+        )
+    return True
+
+
+async def prepare_database(engine: AsyncEngine) -> tuple[list[int], bool]:
+    """Startup routine: pending migrations, then base data if missing.
+
+    Both run in one transaction. On an up to date database this is the
+    schema version lookup and one fuel_types probe, and it never drops
+    anything. Returns the applied versions and whether it seeded.
+    """
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(upgrade)
+        seeded = await conn.run_sync(seed_base_data)
+    return applied, seeded
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+import gzip
+import os
+from typing import Iterator, Optional
+
+import orjson
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import Base
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "archive"))
+# Price quantiles kept per archived month and station, see price_digest().
+DIGEST_QUANTILES = (0.0, 0.01, 0.05, 0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.9, 0.95, 0.99, 1.0)
+
+
+def month_floor(value: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime.datetime, months: int) -> datetime.datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def archive_path(month: datetime.datetime, archived_at: datetime.datetime) -> str:
+    """A new file per archive run, so a failed run leaves the last one intact."""
+    return os.path.join(ARCHIVE_DIR, f"transactions-{month:%Y-%m}-{archived_at:%Y%m%dT%H%M%S%f}.ndjson.gz")
+
+
+def write_row_group(file, columns: tuple, rows: list[tuple]):
+    """Appends one row group: per column value lists plus its date range.
+
+    The date range lets scan() skip groups without decoding them.
+    """
+    date_index = columns.index("date")
+    group = {
+        "rows": len(rows),
+        "date_min": min(row[date_index] for row in rows),
+        "date_max": max(row[date_index] for row in rows),
+        "columns": {name: [row[i] for row in rows] for i, name in enumerate(columns)},
+    }
+    file.write(orjson.dumps(group) + b"\n")
+
+
+def price_digest(prices: list[float]) -> list[float]:
+    """Sorted prices reduced to their value at each of DIGEST_QUANTILES."""
+    digest = []
+    for q in DIGEST_QUANTILES:
+        position = q * (len(prices) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(prices) - 1)
+        digest.append(prices[lower] + (prices[upper] - prices[lower]) * (position - lower))
+    return digest
+
+
+def digest_rank(digest: list[float], value: float) -> float:
+    """Share of a digest's prices at or below value, linear between points."""
+    if value < digest[0]:
+        return 0.0
+    if value >= digest[-1]:
+        return 1.0
+    index = bisect.bisect_right(digest, value)
+    low, high = digest[index - 1], digest[index]
+    step = DIGEST_QUANTILES[index] - DIGEST_QUANTILES[index - 1]
+    return DIGEST_QUANTILES[index - 1] + step * (value - low) / (high - low)
+
+
+def merged_quantile(parts: list[tuple[int, list[float]]], q: float) -> Optional[float]:
+    """Quantile q over (count, digest) parts, by bisecting on the value
+    whose weighted rank across all parts is q."""
+    parts = [(count, digest) for count, digest in parts if count]
+    if not parts:
+        return None
+    target = q * sum(count for count, _ in parts)
+    low = min(digest[0] for _, digest in parts)
+    high = max(digest[-1] for _, digest in parts)
+    for _ in range(64):
+        middle = (low + high) / 2
+        if sum(count * digest_rank(digest, middle) for count, digest in parts) < target:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def archived_stats(month: datetime.datetime, sales: dict[int, list[tuple[float, float]]]) -> list[dict]:
+    """ArchivedStats rows from station_id -> [(price, fuel_quantity), ...]."""
+    rows = []
+    for station_id, station_sales in sales.items():
+        prices = sorted(price for price, _ in station_sales)
+        rows.append(
+            {
+                "month": month,
+                "station_id": station_id,
+                "count": len(prices),
+                "fuel": sum((fuel_quantity for _, fuel_quantity in station_sales), 0.0),
+                "revenue": sum(prices, 0.0),
+                "digest": orjson.dumps(price_digest(prices)).decode(),
+            }
+        )
+    return rows
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class ArchivedMonth(Base):
+    """A month of transactions moved to a gzipped columnar file.
+
+    Each line of the file is a row group written by write_row_group().
+    hourly_rollups keeps the month's rows, so totals and series still
+    read whole hours from the database.
+    """
+
+    __tablename__ = "archived_months"
+
+    month = Column(DateTime, primary_key=True)
+    month_end = Column(DateTime, nullable=False)
+    path = Column(String, nullable=False)
+    rows = Column(Integer, nullable=False)
+    archived_at = Column(DateTime)
+
+    async def overlapping(
+        session: AsyncSession,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> list[ArchivedMonth]:
+        query = select(ArchivedMonth).order_by(ArchivedMonth.month)
+        if date_from is not None:
+            query = query.where(ArchivedMonth.month_end > date_from)
+        if date_to is not None:
+            query = query.where(ArchivedMonth.month <= date_to)
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    def scan(
+        months: list[ArchivedMonth],
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> Iterator[dict]:
+        """Archived rows matching the filters, date bounds inclusive."""
+        lower = None if date_from is None else date_from.isoformat()
+        upper = None if date_to is None else date_to.isoformat()
+        for month in months:
+            with gzip.open(month.path, "rb") as file:
+                for line in file:
+                    group = orjson.loads(line)
+                    if lower is not None and group["date_max"] < lower:
+                        continue
+                    if upper is not None and group["date_min"] > upper:
+                        continue
+                    columns = group["columns"]
+                    names = list(columns)
+                    for values in zip(*columns.values()):
+                        row = dict(zip(names, values))
+                        if station_ids and row["station_id"] not in station_ids:
+                            continue
+                        if fuel_types and row["fuel_type"] not in fuel_types:
+                            continue
+                        if lower is not None and row["date"] < lower:
+                            continue
+                        if upper is not None and row["date"] > upper:
+                            continue
+                        row["date"] = datetime.datetime.fromisoformat(row["date"])
+                        yield row
+
+
+class ArchivedStats(Base):
+    """Totals and price digest of one station's sales in an archived month.
+
+    Lets get_stats() cover archived months without reading their files.
+    Archiving a month again adds a row for the newly archived sales.
+    """
+
+    __tablename__ = "archived_stats"
+
+    id = Column(Integer, primary_key=True)
+    month = Column(DateTime, nullable=False)
+    station_id = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    fuel = Column(Float, nullable=False)
+    revenue = Column(Float, nullable=False)
+    digest = Column(String, nullable=False)
+
+    __table_args__ = (Index("ix_archived_stats_station_id_month", "station_id", "month"),)
+
+    async def for_months(
+        session: AsyncSession,
+        months: list[datetime.datetime],
+        station_id: Optional[int] = None,
+    ) -> list[tuple[int, float, float, list[float]]]:
+        """(count, fuel, revenue, digest) of the months' archived sales."""
+        if not months:
+            return []
+        query = select(ArchivedStats).where(ArchivedStats.month.in_(months))
+        if station_id is not None:
+            query = query.where(ArchivedStats.station_id == station_id)
+        result = await session.execute(query)
+        return [(row.count, row.fuel, row.revenue, orjson.loads(row.digest)) for row in result.scalars()]
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-from typing import List
+import os
+import time
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 from sqlalchemy import Column, Float, Integer, String, insert, select, update
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from broadcast import queue_event
 from db import Base, DbResult
+from versions import table_versions
+
+FUEL_CACHE_TTL = float(os.environ.get("FUEL_CACHE_TTL", "60"))
 
 
 class FuelTypeSchema(BaseModel):
@@ -28,6 +34,7 @@ class FuelType(Base):
             result = await session.execute(insert(FuelType).values((None,self.fuel_name,self.price,)))
             if result.is_insert:
                 await session.commit()
+                table_versions.bump("fuel_types")
                 return DbResult.result(self.id)
             else:
                 raise "Error"
@@ -37,9 +44,20 @@ class FuelType(Base):
         
     async def set_price(session: AsyncSession, fuel_type: int, new_price: float) -> DbResult:
         try:
-            await session.execute(update(FuelType).where(FuelType.id == fuel_type).values(price=new_price))
+            result = await session.execute(
+                update(FuelType)
+                .where(FuelType.id == fuel_type)
+                .values(price=new_price)
+                .returning(FuelType.id, FuelType.fuel_name, FuelType.price)
+            )
+            row = result.first()
+            if row is not None:
+                queue_event(session, "fuel_type", {"id": fuel_type, "price": new_price})
             await session.commit()
-            return DbResult.result(True)
+            table_versions.bump("fuel_types")
+            if row is not None:
+                fuel_type_cache.put(FuelType.from_one_to_schema(row))
+            return DbResult.result(row is not None)
         except Exception as e:
             return DbResult.error(str(e),False)
 
@@ -47,7 +65,6 @@ class FuelType(Base):
         try:
             result = await session.execute(select(FuelType).where(FuelType.id == fueltype_id))
             data = result.scalars().first()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
@@ -56,7 +73,6 @@ class FuelType(Base):
         try:
             result = await session.execute(select(FuelType))
             data = result.scalars().all()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
@@ -79,7 +95,83 @@ class FuelType(Base):
             return []
 
 
-async def init_fuel_type(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+# pylint: disable=C0115,C0116,W0718
+class FuelTypeCache:
+    """Process-wide snapshot of the fuel_types table.
+
+    ``version`` is bumped on every invalidation and a load only stores its
+    rows if no invalidation happened while it was running, so a reload
+    racing update_price cannot bring an old price back. The TTL picks up
+    changes made outside the API.
+    """
+
+    def __init__(self, ttl: float = FUEL_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._rows: Optional[dict[int, FuelTypeSchema]] = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        self.version += 1
+        self._rows = None
+
+    def put(self, fuel_type: FuelTypeSchema):
+        """Stores a row returned by a write on the primary.
+
+        Bumps the version, so a reload already running on a possibly
+        lagging replica cannot put the old row back.
+        """
+        self.version += 1
+        if self._rows is not None:
+            self._rows = {**self._rows, fuel_type.id: fuel_type}
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._rows or {}),
+            "ttl": self.ttl,
+        }
+
+    async def _get_rows(self, session: AsyncSession) -> dict[int, FuelTypeSchema]:
+        rows = self._rows
+        if rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return rows
+        self.misses += 1
+        version = self.version
+        # No commit here, callers may be in the middle of a transaction.
+        result = await session.execute(select(FuelType))
+        rows = {
+            fueltype.id: FuelType.from_one_to_schema(fueltype)
+            for fueltype in result.scalars().all()
+        }
+        if version == self.version:
+            self._rows = rows
+            self._loaded_at = time.monotonic()
+        return rows
+
+    async def refresh(self, session: AsyncSession) -> DbResult:
+        try:
+            self.invalidate()
+            return DbResult.result(list((await self._get_rows(session)).values()))
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_by_id(self, session: AsyncSession, fueltype_id: int) -> DbResult:
+        try:
+            return DbResult.result((await self._get_rows(session)).get(fueltype_id))
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_all(self, session: AsyncSession) -> DbResult:
+        try:
+            return DbResult.result(list((await self._get_rows(session)).values()))
+        except Exception as e:
+            return DbResult.error(str(e))
+
+
+fuel_type_cache = FuelTypeCache()
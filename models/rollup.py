@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import mapped_column
+
+from db import Base
+
+HOUR = datetime.timedelta(hours=1)
+
+
+def hour_floor(value: datetime.datetime) -> datetime.datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def time_bucket(dialect_name: str, size: str, column):
+    """Start of the hour, day or week (from Monday) containing column.
+
+    Must produce the same value the DateTime type stores for that start.
+    """
+    if dialect_name == "postgresql":
+        return func.date_trunc(size, column)
+    if dialect_name == "sqlite":
+        if size == "hour":
+            return func.strftime("%Y-%m-%d %H:00:00.000000", column)
+        if size == "day":
+            return func.strftime("%Y-%m-%d 00:00:00.000000", column)
+        return func.strftime("%Y-%m-%d 00:00:00.000000", column, "weekday 0", "-6 days")
+    if size == "hour":
+        return func.date_format(column, "%Y-%m-%d %H:00:00")
+    if size == "day":
+        return func.date_format(column, "%Y-%m-%d 00:00:00")
+    return func.date_format(func.subdate(column, func.weekday(column)), "%Y-%m-%d 00:00:00")
+
+
+def bucket_floor(value: datetime.datetime, size: str) -> datetime.datetime:
+    """time_bucket() for a Python datetime."""
+    value = hour_floor(value)
+    if size == "hour":
+        return value
+    value = value.replace(hour=0)
+    if size == "day":
+        return value
+    return value - datetime.timedelta(days=value.weekday())
+
+
+def hour_bucket(dialect_name: str, column):
+    return time_bucket(dialect_name, "hour", column)
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class HourlyRollup(Base):
+    __tablename__ = "hourly_rollups"
+
+    station_id = mapped_column(ForeignKey("stations.id"), primary_key=True)
+    fuel_type = mapped_column(ForeignKey("fuel_types.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    fuel_quantity = Column(Float, nullable=False, default=0.0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+    async def apply(session: AsyncSession, sales: list[dict]):
+        """Adds sales to their buckets without committing.
+
+        Each sale is a dict with station_id, fuel_type, date,
+        fuel_quantity and price.
+        """
+        buckets: dict[tuple, dict] = {}
+        for sale in sales:
+            key = (sale["station_id"], sale["fuel_type"], hour_floor(sale["date"]))
+            bucket = buckets.setdefault(
+                key,
+                {
+                    "station_id": key[0],
+                    "fuel_type": key[1],
+                    "hour": key[2],
+                    "fuel_quantity": 0.0,
+                    "revenue": 0.0,
+                    "count": 0,
+                },
+            )
+            bucket["fuel_quantity"] += sale["fuel_quantity"]
+            bucket["revenue"] += sale["price"]
+            bucket["count"] += 1
+        if not buckets:
+            return
+
+        dialect_name = session.bind.dialect.name
+        if dialect_name in ("postgresql", "sqlite"):
+            dialect = postgresql if dialect_name == "postgresql" else sqlite
+            stmt = dialect.insert(HourlyRollup).values(list(buckets.values()))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[HourlyRollup.station_id, HourlyRollup.fuel_type, HourlyRollup.hour],
+                set_={
+                    "fuel_quantity": HourlyRollup.fuel_quantity + stmt.excluded.fuel_quantity,
+                    "revenue": HourlyRollup.revenue + stmt.excluded.revenue,
+                    "count": HourlyRollup.count + stmt.excluded.count,
+                },
+            )
+            await session.execute(stmt)
+            return
+
+        for bucket in buckets.values():
+            result = await session.execute(
+                update(HourlyRollup)
+                .where(HourlyRollup.station_id == bucket["station_id"])
+                .where(HourlyRollup.fuel_type == bucket["fuel_type"])
+                .where(HourlyRollup.hour == bucket["hour"])
+                .values(
+                    fuel_quantity=HourlyRollup.fuel_quantity + bucket["fuel_quantity"],
+                    revenue=HourlyRollup.revenue + bucket["revenue"],
+                    count=HourlyRollup.count + bucket["count"],
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                session.add(HourlyRollup(**bucket))
+        await session.flush()
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
-import asyncio
-from time import sleep
+import datetime
+import os
 from typing import List
 
 from pydantic import BaseModel, Field
 from sqlalchemy import (
     Boolean,
     Column,
+    DateTime,
     Float,
     ForeignKey,
     Integer,
@@ -16,10 +17,17 @@ from sqlalchemy import (
     select,
     update,
 )
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import mapped_column
 
+from broadcast import queue_event
 from db import Base, DbResult
+from versions import table_versions
+
+# Same order as StationSchema, used for the plain row queries.
+STATION_COLUMNS = ("id", "fuel_type", "fuel_quantity", "status")
+# Seconds a station stays closed after a sale.
+REOPEN_DELAY = float(os.environ.get("REOPEN_DELAY", "10"))
 
 
 class StationSchema(BaseModel):
@@ -37,12 +45,16 @@ class Station(Base):
     fuel_type = mapped_column(ForeignKey("fuel_types.id"))
     fuel_quantity = Column(Float)
     status = Column(Boolean)
+    # When a station closed by a sale reopens, NULL otherwise. Kept in the
+    # row so the deadline survives a restart.
+    reopen_at = Column(DateTime)
 
     async def add_first(self, session: AsyncSession) -> DbResult:
         try:
             result = await session.execute(insert(Station).values((self.id,self.fuel_type,self.fuel_quantity,self.status)))
             if result.is_insert:
                 await session.commit()
+                table_versions.bump("stations")
                 return DbResult.result(self.id)
             else:
                 raise "Error"
@@ -55,6 +67,7 @@ class Station(Base):
         try:
             session.add(self)
             await session.commit()
+            table_versions.bump("stations")
             return DbResult.result(self.id)
         except Exception as e:
             await session.rollback()
@@ -62,19 +75,10 @@ class Station(Base):
         
 
 
-    def auto_open(session: AsyncSession, station_id: int) -> DbResult:
-        sleep(10)
-        try:
-            asyncio.run(Station.set_active(session,station_id,True))
-            return DbResult.result()
-        except Exception as e:
-            return DbResult.error(str(e))
-
     async def get_by_id(session: AsyncSession, station_id: int) -> DbResult:
         try:
             result = await session.execute(select(Station).where(Station.id == station_id))
             data = result.scalars().first()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
@@ -82,18 +86,39 @@ class Station(Base):
     
     async def set_active(session: AsyncSession, station_id: int, status: bool) -> DbResult:
         try:
-            result = await session.execute(update(Station).where(Station.id == station_id).values(status=status))
+            result = await session.execute(
+                update(Station).where(Station.id == station_id).values(status=status, reopen_at=None)
+            )
+            if result.rowcount:
+                queue_event(session, "station", {"id": station_id, "status": status})
             await session.commit()
+            table_versions.bump("stations")
             return DbResult.result()
         except Exception as e:
             return DbResult.error(str(e))
         
     
-    async def set_fuel_quantity(session: AsyncSession, station_id: int, quantity: float) -> DbResult:
+    async def reopen_due(session: AsyncSession) -> DbResult:
+        """Reopens the stations whose reopen_at has passed."""
         try:
-            await session.execute(update(Station).where(Station.id == station_id).values(fuel_quantity=Station.fuel_quantity+quantity))
+            result = await session.execute(
+                update(Station)
+                .where(Station.status.is_(False), Station.reopen_at <= datetime.datetime.now())
+                .values(status=True, reopen_at=None)
+            )
             await session.commit()
-            return DbResult.result()
+            table_versions.bump("stations")
+            return DbResult.result(result.rowcount)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_pending_reopens(session: AsyncSession) -> DbResult:
+        """(id, reopen_at) of the closed stations waiting to reopen."""
+        try:
+            result = await session.execute(
+                select(Station.id, Station.reopen_at).where(Station.status.is_(False), Station.reopen_at.is_not(None))
+            )
+            return DbResult.result([tuple(row) for row in result])
         except Exception as e:
             return DbResult.error(str(e))
 
@@ -101,15 +126,23 @@ class Station(Base):
         try:
             result = await session.execute(select(Station))
             data = result.scalars().all()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
         
+    async def get_all_rows(session: AsyncSession) -> DbResult:
+        try:
+            result = await session.execute(select(*[getattr(Station, column) for column in STATION_COLUMNS]))
+            data = result.all()
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
     async def delete(session: AsyncSession, id: int) -> DbResult:
         try:
             _ = await session.execute(delete(Station).where(Station.id == id))
             await session.commit()
+            table_versions.bump("stations")
             return DbResult.result(True)
         except Exception as e:
             await session.rollback()
@@ -134,9 +167,3 @@ class Station(Base):
             return [Station.from_one_to_schema(b) for b in stations]
         except Exception:
             return []
-
-
-async def init_station(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
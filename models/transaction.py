@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import datetime
-from typing import List
+from typing import AsyncIterator, List, Optional
 
 from pydantic import BaseModel, Field
 from sqlalchemy import (
@@ -9,14 +9,51 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
+    case,
+    delete,
+    exists,
+    false,
+    func,
+    insert,
+    literal,
+    or_,
     select,
+    type_coerce,
+    union_all,
+    update,
 )
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import Select
 
-from db import Base, DbResult
+from broadcast import queue_event
+from db import Base, DbResult, async_stream_session
+from models.fuel_type import fuel_type_cache
+from models.archive import (
+    DIGEST_QUANTILES,
+    ArchivedMonth,
+    ArchivedStats,
+    merged_quantile,
+    month_floor,
+    price_digest,
+)
+from models.rollup import HOUR, HourlyRollup, bucket_floor, hour_bucket, hour_floor, time_bucket
+from models.station import REOPEN_DELAY, Station
+from versions import table_versions
+
+REFILL_THRESHOLD = 1000.0
+REFILL_QUANTITY = 1000.0
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+TICK = datetime.timedelta(microseconds=1)
+# Archived sales per rollup upsert, keeps each statement's parameters
+# under SQLite's limit.
+ROLLUP_REBUILD_BATCH = 2000
+# Same order as TransactionSchema, used for the plain row queries.
+EXPORT_COLUMNS = ("id", "number", "fuel_quantity", "fuel_type", "price", "date", "station_id")
+SERIES_COLUMNS = ("station_id", "bucket", "fuel", "revenue", "count", "avg_ticket")
 
 
 class TransactionSchema(BaseModel):
@@ -40,7 +77,20 @@ class Transaction(Base):
     price = Column(Float)
     date = Column(DateTime)
     station_id = mapped_column(ForeignKey("stations.id"))
-   
+
+    # The *_id indexes back the newest-first keyset pages of the list
+    # queries, the *_date ones the stats and export range filters. The
+    # (date, id) index also serves plain date ranges. Existing databases
+    # get new indexes through migrations.py.
+    __table_args__ = (
+        Index("ix_transactions_station_id_id", "station_id", "id"),
+        Index("ix_transactions_fuel_type_id", "fuel_type", "id"),
+        Index("ix_transactions_date_id", "date", "id"),
+        Index("ix_transactions_station_id_date", "station_id", "date"),
+        Index("ix_transactions_fuel_type_date", "fuel_type", "date"),
+        Index("ix_transactions_number", "number"),
+    )
+
 
     async def add(self, session: AsyncSession) -> DbResult:
         try:
@@ -51,62 +101,652 @@ class Transaction(Base):
             await session.rollback()
             return DbResult.error(str(e), False)
 
+    async def dispense(session: AsyncSession, number: str, station_id: int, fuel_quantity: float) -> DbResult:
+        """Sells fuel in one DB transaction.
+
+        On error ``value`` holds the HTTP code for the route to return.
+        """
+        try:
+            result = await Transaction._dispense(session, number, station_id, fuel_quantity)
+            if result.is_error:
+                await session.rollback()
+                return result
+            await session.commit()
+            table_versions.bump("stations")
+            return result
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e), 500)
+
+    async def _dispense(session: AsyncSession, number: str, station_id: int, fuel_quantity: float) -> DbResult:
+        """Sells fuel in the caller's transaction.
+
+        An error result leaves nothing behind: the sale runs in a savepoint
+        when the session already holds other work (the write buffer's
+        batch) and is rolled back to it, otherwise the session is rolled
+        back.
+        """
+        savepoint = await session.begin_nested() if session.in_transaction() else None
+        try:
+            result = await Transaction._sell(session, number, station_id, fuel_quantity)
+        except Exception:
+            if savepoint is not None:
+                await savepoint.rollback()
+            raise
+        if result.is_error:
+            # The station UPDATE may already have run, e.g. when the fuel
+            # type lookup fails after it.
+            if savepoint is not None:
+                await savepoint.rollback()
+            else:
+                await session.rollback()
+        elif savepoint is not None:
+            await savepoint.commit()
+        return result
+
+    async def _sell(session: AsyncSession, number: str, station_id: int, fuel_quantity: float) -> DbResult:
+        # The stock check, decrement, refill and status flip are one
+        # conditional UPDATE, so concurrent sales cannot lose updates.
+        available = (
+            (Station.id == station_id)
+            & Station.status.is_(True)
+            & (Station.fuel_quantity >= fuel_quantity)
+        )
+        remaining = Station.fuel_quantity - fuel_quantity
+        new_quantity = case(
+            (remaining < REFILL_THRESHOLD, remaining + REFILL_QUANTITY),
+            else_=remaining,
+        )
+        dispense_stmt = (
+            update(Station)
+            .where(available)
+            .values(
+                fuel_quantity=new_quantity,
+                status=False,
+                reopen_at=datetime.datetime.now() + datetime.timedelta(seconds=REOPEN_DELAY),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if session.bind.dialect.update_returning:
+            result = await session.execute(dispense_stmt.returning(Station.fuel_type, Station.fuel_quantity))
+            station = result.first()
+        else:
+            result = await session.execute(
+                select(Station.fuel_type, new_quantity.label("fuel_quantity")).where(available).with_for_update()
+            )
+            station = result.first()
+            if station is not None:
+                await session.execute(dispense_stmt)
+
+        if station is None:
+            result = await session.execute(select(Station.fuel_quantity, Station.status).where(Station.id == station_id))
+            current = result.first()
+            if current is None:
+                return DbResult.error("Station Not Found", 500)
+            if current.fuel_quantity < fuel_quantity:
+                return DbResult.error("Fuel not enough in station", 501)
+            return DbResult.error("Station status is false", 502)
+        fuel_type = station.fuel_type
+
+        fuel_result = await fuel_type_cache.get_by_id(session, fuel_type)
+        if fuel_result.is_error:
+            return DbResult.error(fuel_result.error_desc, 500)
+        if fuel_result.value is None:
+            return DbResult.error("Fuel Not Found", 500)
+        sale = {
+            "number": number,
+            "fuel_quantity": fuel_quantity,
+            "fuel_type": fuel_type,
+            "price": fuel_result.value.price * fuel_quantity,
+            "date": datetime.datetime.now(),
+            "station_id": station_id,
+        }
+        result = await session.execute(insert(Transaction).values(**sale))
+        transaction_id = result.inserted_primary_key[0]
+        await HourlyRollup.apply(session, [sale])
+        queue_event(session, "station", {"id": station_id, "status": False, "fuel_quantity": station.fuel_quantity})
+        return DbResult.result(transaction_id)
+
+    async def add_batch(session: AsyncSession, sales: list[dict]) -> DbResult:
+        """Validates sales in order and stores the accepted ones at once.
+
+        Each sale is a dict with number, fuel_quantity, station_id and
+        an optional date. The sales already happened at the forecourt, so
+        station status is not checked and stations are not closed. Value
+        is one (code, error_desc, id) tuple per sale.
+        """
+        try:
+            station_ids = {sale["station_id"] for sale in sales}
+            result = await session.execute(
+                select(Station.id, Station.fuel_type, Station.fuel_quantity)
+                .where(Station.id.in_(station_ids))
+                .with_for_update()
+            )
+            stations = {row.id: row for row in result}
+            remaining = {station_id: row.fuel_quantity for station_id, row in stations.items()}
+            fuel_result = await fuel_type_cache.get_all(session)
+            if fuel_result.is_error:
+                raise RuntimeError(fuel_result.error_desc)
+            prices = {fueltype.id: fueltype.price for fueltype in fuel_result.value}
+
+            results = []
+            rows = []
+            now = datetime.datetime.now()
+            for sale in sales:
+                station = stations.get(sale["station_id"])
+                if sale["fuel_quantity"] <= 0:
+                    results.append((503, "Fuel quantity must be greater than 0", None))
+                elif station is None:
+                    results.append((500, "Station Not Found", None))
+                elif station.fuel_type not in prices:
+                    results.append((500, "Fuel Not Found", None))
+                elif remaining[station.id] < sale["fuel_quantity"]:
+                    results.append((501, "Fuel not enough in station", None))
+                else:
+                    remaining[station.id] -= sale["fuel_quantity"]
+                    if remaining[station.id] < REFILL_THRESHOLD:
+                        remaining[station.id] += REFILL_QUANTITY
+                    results.append((200, "", len(rows)))
+                    rows.append(
+                        {
+                            "number": sale["number"],
+                            "fuel_quantity": sale["fuel_quantity"],
+                            "fuel_type": station.fuel_type,
+                            "price": prices[station.fuel_type] * sale["fuel_quantity"],
+                            "date": sale.get("date") or now,
+                            "station_id": station.id,
+                        }
+                    )
+            if not rows:
+                await session.rollback()
+                return DbResult.result(results)
+
+            if session.bind.dialect.insert_executemany_returning_sort_by_parameter_order:
+                result = await session.execute(
+                    insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+                    rows,
+                )
+                ids = result.scalars().all()
+            else:
+                ids = []
+                for row in rows:
+                    result = await session.execute(insert(Transaction).values(**row))
+                    ids.append(result.inserted_primary_key[0])
+
+            for station_id, quantity in remaining.items():
+                delta = quantity - stations[station_id].fuel_quantity
+                if delta:
+                    await session.execute(
+                        update(Station)
+                        .where(Station.id == station_id)
+                        .values(fuel_quantity=Station.fuel_quantity + delta)
+                        .execution_options(synchronize_session=False)
+                    )
+                    queue_event(session, "station", {"id": station_id, "fuel_quantity": quantity})
+            await HourlyRollup.apply(session, rows)
+            await session.commit()
+            table_versions.bump("stations")
+            return DbResult.result(
+                [(code, error_desc, None if row is None else ids[row]) for code, error_desc, row in results]
+            )
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
     async def get_by_id(session: AsyncSession, transaction_id: int) -> DbResult:
         try:
             result = await session.execute(select(Transaction).where(Transaction.id == transaction_id))
             data = result.scalars().first()
-            await session.commit()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
-    async def get_by_station_and_time(session: AsyncSession, station_id: int,date_from: datetime.datetime, date_to: datetime.datetime) -> DbResult:
+
+    def _filters(
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> list:
+        conditions = []
+        if station_id is not None:
+            conditions.append(Transaction.station_id == station_id)
+        if date_from is not None:
+            conditions.append(Transaction.date >= date_from)
+        if date_to is not None:
+            conditions.append(Transaction.date <= date_to)
+        return conditions
+
+    def _edge_hours(
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> tuple[Optional[datetime.datetime], Optional[datetime.datetime]]:
+        """First and last whole hour of a date range, None if unbounded."""
+        first_hour = None
+        if date_from is not None:
+            first_hour = hour_floor(date_from)
+            if first_hour != date_from:
+                first_hour += HOUR
+        last_hour = None if date_to is None else hour_floor(date_to)
+        return first_hour, last_hour
+
+    async def _archived_edges(
+        session: AsyncSession,
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> list[dict]:
+        """Archived rows in the partial edge hours that _rollup_union reads
+        from transactions. Whole hours of archived months stay in
+        hourly_rollups."""
+        first_hour, last_hour = Transaction._edge_hours(date_from, date_to)
+        if first_hour is not None and last_hour is not None and first_hour >= last_hour:
+            ranges = [(date_from, date_to)]
+        else:
+            ranges = []
+            if first_hour is not None and first_hour != date_from:
+                ranges.append((date_from, first_hour - TICK))
+            if last_hour is not None:
+                ranges.append((last_hour, date_to))
+        rows = []
+        for lower, upper in ranges:
+            months = await ArchivedMonth.overlapping(session, lower, upper)
+            if months:
+                rows.extend(ArchivedMonth.scan(months, station_ids, fuel_types, lower, upper))
+        return rows
+
+    def _rollup_union(
+        rollup_columns: list,
+        edge_columns: list,
+        rollup_conditions: list,
+        edge_conditions: list,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ):
+        """hourly_rollups rows for the whole hours of a date range, unioned
+        with the transactions in the partial hours at its edges.
+
+        Both column lists must label the same names in the same order.
+        """
+        first_hour, last_hour = Transaction._edge_hours(date_from, date_to)
+        edges = select(*edge_columns).where(
+            *Transaction._filters(None, date_from, date_to), *edge_conditions
+        )
+        if first_hour is not None and last_hour is not None and first_hour >= last_hour:
+            return edges.subquery()
+        rollups = select(*rollup_columns).where(*rollup_conditions)
+        bounds = []
+        if first_hour is not None:
+            rollups = rollups.where(HourlyRollup.hour >= first_hour)
+            bounds.append(Transaction.date < first_hour)
+        if last_hour is not None:
+            rollups = rollups.where(HourlyRollup.hour < last_hour)
+            bounds.append(Transaction.date >= last_hour)
+        edges = edges.where(or_(false(), *bounds))
+        return union_all(rollups, edges).subquery()
+
+    async def get_totals(
+        session: AsyncSession,
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        """Litres, revenue and count over a date range.
+
+        Whole hours inside the range come from hourly_rollups, only the
+        partial hours at the edges are read from transactions.
+        """
+        try:
+            parts = Transaction._rollup_union(
+                [
+                    HourlyRollup.fuel_quantity.label("fuel"),
+                    HourlyRollup.revenue.label("revenue"),
+                    HourlyRollup.count.label("count"),
+                ],
+                [
+                    Transaction.fuel_quantity.label("fuel"),
+                    Transaction.price.label("revenue"),
+                    literal(1).label("count"),
+                ],
+                [] if station_id is None else [HourlyRollup.station_id == station_id],
+                [] if station_id is None else [Transaction.station_id == station_id],
+                date_from,
+                date_to,
+            )
+            query = select(
+                func.coalesce(func.sum(parts.c.fuel), 0.0).label("fuel"),
+                func.coalesce(func.sum(parts.c.revenue), 0.0).label("revenue"),
+                func.coalesce(func.sum(parts.c.count), 0).label("count"),
+            )
+            result = await session.execute(query)
+            data = dict(result.one()._mapping)
+            station_ids = None if station_id is None else [station_id]
+            for row in await Transaction._archived_edges(session, station_ids, None, date_from, date_to):
+                data["fuel"] += row["fuel_quantity"]
+                data["revenue"] += row["price"]
+                data["count"] += 1
+            return DbResult.result(data)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    async def get_series(
+        session: AsyncSession,
+        bucket: str = "day",
+        station_ids: Optional[list[int]] = None,
+        fuel_types: Optional[list[int]] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        """SERIES_COLUMNS rows per station and hour, day or week bucket.
+
+        One grouped query over the same rollup/edge union as get_totals.
+        """
+        try:
+            dialect_name = session.bind.dialect.name
+            rollup_conditions = []
+            edge_conditions = []
+            if station_ids:
+                rollup_conditions.append(HourlyRollup.station_id.in_(station_ids))
+                edge_conditions.append(Transaction.station_id.in_(station_ids))
+            if fuel_types:
+                rollup_conditions.append(HourlyRollup.fuel_type.in_(fuel_types))
+                edge_conditions.append(Transaction.fuel_type.in_(fuel_types))
+            parts = Transaction._rollup_union(
+                [
+                    HourlyRollup.station_id.label("station_id"),
+                    time_bucket(dialect_name, bucket, HourlyRollup.hour).label("bucket"),
+                    HourlyRollup.fuel_quantity.label("fuel"),
+                    HourlyRollup.revenue.label("revenue"),
+                    HourlyRollup.count.label("count"),
+                ],
+                [
+                    Transaction.station_id.label("station_id"),
+                    time_bucket(dialect_name, bucket, Transaction.date).label("bucket"),
+                    Transaction.fuel_quantity.label("fuel"),
+                    Transaction.price.label("revenue"),
+                    literal(1).label("count"),
+                ],
+                rollup_conditions,
+                edge_conditions,
+                date_from,
+                date_to,
+            )
+            revenue = func.sum(parts.c.revenue)
+            count = func.sum(parts.c.count)
+            query = (
+                select(
+                    parts.c.station_id,
+                    type_coerce(parts.c.bucket, DateTime).label("bucket"),
+                    func.sum(parts.c.fuel).label("fuel"),
+                    revenue.label("revenue"),
+                    count.label("count"),
+                    (revenue / count).label("avg_ticket"),
+                )
+                .group_by(parts.c.station_id, parts.c.bucket)
+                .order_by(parts.c.station_id, parts.c.bucket)
+            )
+            result = await session.execute(query)
+            rows = result.all()
+            archived = await Transaction._archived_edges(session, station_ids, fuel_types, date_from, date_to)
+            if archived:
+                series = {(row.station_id, row.bucket): list(row) for row in rows}
+                for sale in archived:
+                    key = (sale["station_id"], bucket_floor(sale["date"], bucket))
+                    point = series.setdefault(key, [key[0], key[1], 0.0, 0.0, 0, 0.0])
+                    point[2] += sale["fuel_quantity"]
+                    point[3] += sale["price"]
+                    point[4] += 1
+                    point[5] = point[3] / point[4]
+                rows = [tuple(series[key]) for key in sorted(series)]
+            return DbResult.result(rows)
+        except Exception as e:
+            return DbResult.error(str(e))
+
+    def rollup_insert(dialect: str):
+        """INSERT INTO hourly_rollups the hourly totals of transactions."""
+        hour = hour_bucket(dialect, Transaction.date)
+        query = select(
+            Transaction.station_id,
+            Transaction.fuel_type,
+            hour,
+            func.sum(Transaction.fuel_quantity),
+            func.sum(Transaction.price),
+            func.count(Transaction.id),
+        ).group_by(Transaction.station_id, Transaction.fuel_type, hour)
+        return insert(HourlyRollup).from_select(
+            ["station_id", "fuel_type", "hour", "fuel_quantity", "revenue", "count"],
+            query,
+        )
+
+    async def rebuild_rollups(session: AsyncSession) -> DbResult:
+        """Recomputes hourly_rollups from live rows and archive files.
+
+        Archived months can still have live rows (back-dated sales, rows
+        added after archiving), so their buckets are rebuilt as well: the
+        live totals are inserted first and the archived rows added on top.
+        """
         try:
-            result = await session.execute(select(Transaction).where(Transaction.station_id == station_id).where(Transaction.date >= date_from).where(Transaction.date <= date_to))
-            data = result.scalars().all()
+            await session.execute(delete(HourlyRollup))
+            await session.execute(Transaction.rollup_insert(session.bind.dialect.name))
+            for month in await ArchivedMonth.overlapping(session):
+                sales = []
+                for row in ArchivedMonth.scan([month]):
+                    sales.append(row)
+                    if len(sales) == ROLLUP_REBUILD_BATCH:
+                        await HourlyRollup.apply(session, sales)
+                        sales = []
+                await HourlyRollup.apply(session, sales)
+            count = (await session.execute(select(func.count()).select_from(HourlyRollup))).scalar()
             await session.commit()
+            return DbResult.result(count)
+        except Exception as e:
+            await session.rollback()
+            return DbResult.error(str(e))
+
+    def _stats_query(dialect: str, conditions: list, quantiles: dict[str, float]) -> Select:
+        """Count, totals, average and quantiles of price in one query.
+
+        Postgres uses percentile_cont, other backends interpolate the same
+        way from ROW_NUMBER() over the matching prices.
+        """
+        if dialect == "postgresql":
+            source = Transaction.__table__
+            percentiles = [
+                func.percentile_cont(q).within_group(Transaction.price).label(name)
+                for name, q in quantiles.items()
+            ]
+        else:
+            source = (
+                select(
+                    Transaction.id,
+                    Transaction.price,
+                    Transaction.fuel_quantity,
+                    (func.row_number().over(order_by=Transaction.price) - 1).label("rank"),
+                    func.count().over().label("total"),
+                )
+                .where(*conditions)
+                .subquery()
+            )
+            conditions = []
+            percentiles = []
+            for name, q in quantiles.items():
+                position = q * (source.c.total - 1)
+                lower_rank = func.max(case((source.c.rank <= position, source.c.rank)))
+                lower = func.max(case((source.c.rank <= position, source.c.price)))
+                upper = func.min(case((source.c.rank >= position, source.c.price)))
+                percentiles.append(
+                    (lower + (upper - lower) * (func.max(position) - lower_rank)).label(name)
+                )
+        return select(
+            func.count(source.c.id).label("count"),
+            func.coalesce(func.sum(source.c.fuel_quantity), 0.0).label("fuel"),
+            func.coalesce(func.sum(source.c.price), 0.0).label("revenue"),
+            func.avg(source.c.price).label("avg_price"),
+            *percentiles,
+        ).where(*conditions)
+
+    async def get_stats(
+        session: AsyncSession,
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> DbResult:
+        """Count, totals, average and PERCENTILES of price.
+
+        One _stats_query() over live rows, which also checks for archived
+        sales of the station in the range. Only when there are some does
+        _with_archived() add them in.
+        """
+        try:
+            dialect = session.bind.dialect.name
+            conditions = Transaction._filters(station_id, date_from, date_to)
+            archived = select(ArchivedStats.id)
+            if station_id is not None:
+                archived = archived.where(ArchivedStats.station_id == station_id)
+            if date_from is not None:
+                archived = archived.where(ArchivedStats.month >= month_floor(date_from))
+            if date_to is not None:
+                archived = archived.where(ArchivedStats.month <= date_to)
+            query = Transaction._stats_query(dialect, conditions, PERCENTILES)
+            result = await session.execute(query.add_columns(exists(archived).label("archived")))
+            data = dict(result.one()._mapping)
+            if data.pop("archived"):
+                data = await Transaction._with_archived(session, data, station_id, date_from, date_to)
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
-    
-    async def get_by_station(session: AsyncSession, station_id: int) -> DbResult:
+
+    async def _with_archived(
+        session: AsyncSession,
+        data: dict,
+        station_id: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> dict:
+        """get_stats() live data plus the range's archived sales.
+
+        Months wholly in the range come from ArchivedStats, the one or two
+        it cuts through are scanned. Percentiles are then merged from the
+        price digests of every part, so they are close but not exact.
+        """
+        months = await ArchivedMonth.overlapping(session, date_from, date_to)
+        whole = [
+            month.month
+            for month in months
+            if (date_from is None or month.month >= date_from)
+            and (date_to is None or month.month_end - TICK <= date_to)
+        ]
+        parts = await ArchivedStats.for_months(session, whole, station_id)
+        partial = [month for month in months if month.month not in whole]
+        if partial:
+            station_ids = None if station_id is None else [station_id]
+            rows = list(ArchivedMonth.scan(partial, station_ids, None, date_from, date_to))
+            if rows:
+                prices = sorted(row["price"] for row in rows)
+                fuel = sum((row["fuel_quantity"] for row in rows), 0.0)
+                parts.append((len(prices), fuel, sum(prices, 0.0), price_digest(prices)))
+        if not parts:
+            return data
+        if data["count"]:
+            conditions = Transaction._filters(station_id, date_from, date_to)
+            quantiles = {f"q{index}": q for index, q in enumerate(DIGEST_QUANTILES)}
+            query = Transaction._stats_query(session.bind.dialect.name, conditions, quantiles)
+            live = (await session.execute(query)).one()._mapping
+            parts.append((data["count"], data["fuel"], data["revenue"], [live[name] for name in quantiles]))
+        count = sum(part[0] for part in parts)
+        data = {
+            "count": count,
+            "fuel": sum(part[1] for part in parts),
+            "revenue": sum(part[2] for part in parts),
+        }
+        data["avg_price"] = data["revenue"] / count
+        digests = [(part[0], part[3]) for part in parts]
+        for name, q in PERCENTILES.items():
+            data[name] = merged_quantile(digests, q)
+        return data
+
+    def _page(query: Select, after_id: Optional[int], limit: Optional[int]) -> Select:
+        if after_id is not None:
+            query = query.where(Transaction.id < after_id)
+        query = query.order_by(Transaction.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def _row_query() -> Select:
+        return select(*[getattr(Transaction, column) for column in EXPORT_COLUMNS])
+
+    async def get_all_rows(session: AsyncSession, after_id: Optional[int] = None, limit: Optional[int] = None) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.station_id == station_id))
-            data = result.scalars().all()
-            await session.commit()
+            result = await session.execute(Transaction._page(Transaction._row_query(), after_id, limit))
+            data = result.all()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
-    async def get_all(session: AsyncSession) -> DbResult:
+
+    async def get_by_fuel_type_rows(session: AsyncSession, fuel_type: int, after_id: Optional[int] = None, limit: Optional[int] = None) -> DbResult:
         try:
-            result = await session.execute(select(Transaction))
-            data = result.scalars().all()
-            await session.commit()
+            query = Transaction._row_query().where(Transaction.fuel_type == fuel_type)
+            result = await session.execute(Transaction._page(query, after_id, limit))
+            data = result.all()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
-    async def get_by_date(session: AsyncSession,date_from: datetime.datetime, date_to: datetime.datetime) -> DbResult:
+    async def get_by_station_rows(session: AsyncSession, station_id: int, after_id: Optional[int] = None, limit: Optional[int] = None) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.date >= date_from).where(Transaction.date <= date_to))
-            data = result.scalars().all()
-            await session.commit()
+            query = Transaction._row_query().where(Transaction.station_id == station_id)
+            result = await session.execute(Transaction._page(query, after_id, limit))
+            data = result.all()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
-        
 
-    async def get_by_fuel_type(session: AsyncSession, fuel_type: int) -> DbResult:
+    async def get_by_date_rows(session: AsyncSession, date_from: datetime.datetime, date_to: datetime.datetime, after_id: Optional[int] = None, limit: Optional[int] = None) -> DbResult:
         try:
-            result = await session.execute(select(Transaction).where(Transaction.fuel_type == fuel_type))
-            data = result.scalars().all()
-            await session.commit()
+            # Newest first by date, so the cursor is the (date, id) of after_id.
+            query = Transaction._row_query().where(Transaction.date >= date_from).where(Transaction.date <= date_to)
+            if after_id is not None:
+                cursor_date = select(Transaction.date).where(Transaction.id == after_id).scalar_subquery()
+                query = query.where(
+                    (Transaction.date < cursor_date)
+                    | ((Transaction.date == cursor_date) & (Transaction.id < after_id))
+                )
+            query = query.order_by(Transaction.date.desc(), Transaction.id.desc())
+            if limit is not None:
+                query = query.limit(limit)
+            result = await session.execute(query)
+            data = result.all()
             return DbResult.result(data)
         except Exception as e:
             return DbResult.error(str(e))
 
+    async def stream_rows(
+        station_id: Optional[int] = None,
+        fuel_type: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[list[tuple]]:
+        """Yields EXPORT_COLUMNS rows in batches from a server-side cursor.
+
+        Opens its own read session, the request session is closed before a
+        streamed response finishes.
+        """
+        query = Transaction._row_query()
+        if station_id is not None:
+            query = query.where(Transaction.station_id == station_id)
+        if fuel_type is not None:
+            query = query.where(Transaction.fuel_type == fuel_type)
+        if date_from is not None:
+            query = query.where(Transaction.date >= date_from)
+        if date_to is not None:
+            query = query.where(Transaction.date <= date_to)
+        query = query.order_by(Transaction.id).execution_options(yield_per=batch_size)
+        async with async_stream_session() as session, session.begin():
+            result = await session.stream(query)
+            async for rows in result.partitions():
+                yield rows
+
     def from_one_to_schema(transaction: Transaction) -> TransactionSchema:
         try:
             transaction_schema = TransactionSchema(
@@ -127,9 +767,3 @@ class Transaction(Base):
             return [Transaction.from_one_to_schema(b) for b in transactions]
         except Exception:
             return []
-
-
-async def init_transaction(engine: AsyncEngine):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
@@ -0,0 +1,42 @@
+from typing import Iterable, Sequence
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+
+def rows_response(columns: Sequence[str], rows: Iterable[tuple]) -> Response:
+    """Encodes SQL rows straight into a list response.
+
+    Produces the same body as a *sResponse model with code 200, without
+    building a schema per row or validating the list again through
+    response_model.
+    """
+    body = {
+        "code": 200,
+        "error_desc": None,
+        "values": [dict(zip(columns, row)) for row in rows],
+    }
+    return Response(orjson.dumps(body), media_type="application/json")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match lists etag, compared weakly."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tag = etag.removeprefix("W/")
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == tag
+        for candidate in (part.strip() for part in header.split(","))
+    )
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,147 @@
+from typing import Optional
+
+from fastapi import FastAPI, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+import metrics
+from analytics import ANALYTICS, transaction_analytics
+from broadcast import hub
+from db import engine, pool_stats, read_engine
+from models.fuel_type import fuel_type_cache
+from scheduler import reopen_scheduler
+from slow_queries import slow_query_log
+from write_buffer import sale_write_buffer
+
+
+class PoolStatsSchema(BaseModel):
+    checkouts: int = Field(exclude=False, title="checkouts")
+    wait_total_ms: float = Field(exclude=False, title="wait_total_ms")
+    wait_max_ms: float = Field(exclude=False, title="wait_max_ms")
+    size: int = Field(exclude=False, title="size")
+    checked_in: int = Field(exclude=False, title="checked_in")
+    checked_out: int = Field(exclude=False, title="checked_out")
+    overflow: int = Field(exclude=False, title="overflow")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class PoolStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[dict[str, PoolStatsSchema]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[dict[str, PoolStatsSchema]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+class SlowQuerySchema(BaseModel):
+    shape: str = Field(exclude=False, title="shape")
+    statement: str = Field(exclude=False, title="statement")
+    count: int = Field(exclude=False, title="count")
+    total_ms: float = Field(exclude=False, title="total_ms")
+    avg_ms: float = Field(exclude=False, title="avg_ms")
+    max_ms: float = Field(exclude=False, title="max_ms")
+    method: Optional[str] = Field(exclude=False, title="method")
+    route: Optional[str] = Field(exclude=False, title="route")
+    plan: Optional[list[str]] = Field(exclude=False, title="plan")
+
+
+class SlowQueriesResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[SlowQuerySchema]] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[SlowQuerySchema]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def engines() -> dict:
+    if read_engine is engine:
+        return {"write": engine}
+    return {"write": engine, "read": read_engine}
+
+
+def service_metrics() -> list[str]:
+    pools = {name: pool_stats(async_engine) for name, async_engine in engines().items()}
+    lines = []
+    for key, help_text in (
+        ("size", "Configured pool size."),
+        ("checked_out", "Connections in use."),
+        ("checked_in", "Idle connections in the pool."),
+        ("overflow", "Connections over the pool size."),
+    ):
+        lines += metrics.gauge(
+            f"db_pool_{key}", help_text, [((name,), stats[key]) for name, stats in pools.items()], ("engine",)
+        )
+    lines += metrics.counter(
+        "db_pool_checkouts_total",
+        "Connection checkouts.",
+        [((name,), stats["checkouts"]) for name, stats in pools.items()],
+        ("engine",),
+    )
+    lines += metrics.counter(
+        "db_pool_wait_seconds_total",
+        "Time spent waiting for a connection.",
+        [((name,), stats["wait_total_ms"] / 1000) for name, stats in pools.items()],
+        ("engine",),
+    )
+    lines += metrics.gauge("station_reopen_pending", "Stations waiting to reopen.", [((), reopen_scheduler.pending())])
+    cache = fuel_type_cache.stats()
+    lines += metrics.counter(
+        "fuel_type_cache_requests_total",
+        "Fuel type cache lookups.",
+        [(("hit",), cache["hits"]), (("miss",), cache["misses"])],
+        ("result",),
+    )
+    events = hub.stats()
+    lines += metrics.gauge("event_subscribers", "Connected event stream clients.", [((), events["subscribers"])])
+    lines += metrics.counter("events_published_total", "Change events published.", [((), events["published"])])
+    lines += metrics.counter("events_dropped_total", "Events dropped from full client queues.", [((), events["dropped"])])
+    if ANALYTICS:
+        analytics = transaction_analytics.stats()
+        lines += metrics.gauge("analytics_rows", "Transactions loaded into the analytics engine.", [((), analytics["rows"])])
+        lines += metrics.gauge("analytics_memory_bytes", "Memory held by the analytics arrays.", [((), analytics["memory_bytes"])])
+        lines += metrics.gauge("analytics_last_refresh_seconds", "Duration of the last analytics refresh.", [((), analytics["last_refresh_ms"] / 1000)])
+    buffer = sale_write_buffer.stats()
+    lines += metrics.gauge("write_buffer_pending", "Sales waiting for a group commit.", [((), buffer["pending"])])
+    lines += metrics.counter("write_buffer_flushes_total", "Group commits.", [((), buffer["flushes"])])
+    lines += metrics.counter("write_buffer_rows_total", "Sales stored by group commits.", [((), buffer["rows"])])
+    lines += metrics.counter("write_buffer_flush_errors_total", "Group commits that failed as a whole.", [((), buffer["errors"])])
+    lines += metrics.gauge("write_buffer_interval_ms", "Longest wait before a group commit.", [((), buffer["interval_ms"])])
+    lines += metrics.gauge("write_buffer_max_rows", "Sales that trigger a group commit at once.", [((), buffer["max_rows"])])
+    return lines
+
+
+def init_admin_routes(app: FastAPI):
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(
+            metrics.render(service_metrics()),
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    @app.get("/admin/pool_stats", response_model=PoolStatsResponse)
+    async def get_pool_stats():
+        return PoolStatsResponse(
+            code=200,
+            value={name: PoolStatsSchema(**pool_stats(async_engine)) for name, async_engine in engines().items()},
+        )
+
+    @app.get("/admin/slow_queries", response_model=SlowQueriesResponse)
+    async def get_slow_queries(limit: int = Query(default=20, ge=1, le=500)):
+        """Statement shapes over SLOW_QUERY_MS, the most total time first."""
+        return SlowQueriesResponse(
+            code=200,
+            value=[SlowQuerySchema(**shape) for shape in slow_query_log.top(limit)],
+        )
@@ -0,0 +1,50 @@
+from typing import Optional
+
+from fastapi import FastAPI, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from broadcast import hub
+
+
+class EventStatsSchema(BaseModel):
+    subscribers: int = Field(exclude=False, title="subscribers")
+    published: int = Field(exclude=False, title="published")
+    dropped: int = Field(exclude=False, title="dropped")
+    queue_size: int = Field(exclude=False, title="queue_size")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class EventStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[EventStatsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[EventStatsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+def init_events_routes(app: FastAPI):
+
+    @app.get("/events")
+    async def subscribe(station_id: Optional[list[int]] = Query(default=None)):
+        """Server-Sent Events stream.
+
+        ``station`` events carry the station id and whichever of status
+        and fuel_quantity changed, ``fuel_type`` events the id and new
+        price. Repeat station_id to only get those stations' events.
+        """
+        return StreamingResponse(
+            hub.stream(station_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/events/stats", response_model=EventStatsResponse)
+    async def event_stats():
+        return EventStatsResponse(code=200, value=EventStatsSchema(**hub.stats()))
@@ -1,11 +1,13 @@
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.fuel_type import FuelType, FuelTypeSchema
+from db import DbResult, get_read_session, get_session
+from models.fuel_type import FuelType, FuelTypeSchema, fuel_type_cache
+from responses import etag_matches, not_modified, with_etag
+from versions import table_versions
 
 
 class NewValue(BaseModel):
@@ -27,6 +29,29 @@ class UpdateResponse(BaseModel):
     ):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
+class CacheStatsSchema(BaseModel):
+    version: int = Field(exclude=False, title="version")
+    hits: int = Field(exclude=False, title="hits")
+    misses: int = Field(exclude=False, title="misses")
+    size: int = Field(exclude=False, title="size")
+    ttl: float = Field(exclude=False, title="ttl")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class CacheStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[CacheStatsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[CacheStatsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class FuelTypeResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -62,16 +87,21 @@ def init_fuel_type_routes(app: FastAPI):
 
     @app.get("/fuel_types/get_by_id/{id}", response_model=FuelTypeResponse)
     async def get_by_id(
+        request: Request,
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await FuelType.get_by_id(session, id)
+            etag = table_versions.etag("fuel_types")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            result: DbResult = await fuel_type_cache.get_by_id(session, id)
             if result.is_error is True:
                 response.status_code = 500
                 return FuelTypeResponse(code=500, error_desc=result.error_desc)
-            return FuelTypeResponse(code=200, value=FuelType.from_one_to_schema(result.value))
+            with_etag(response, etag)
+            return FuelTypeResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
             return FuelTypeResponse(code=500, error_desc=str(e))
@@ -80,15 +110,20 @@ def init_fuel_type_routes(app: FastAPI):
 
     @app.get("/fuel_types/get_all", response_model=FuelTypesResponse)
     async def get_all(
+        request: Request,
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await FuelType.get_all(session)
+            etag = table_versions.etag("fuel_types")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            result: DbResult = await fuel_type_cache.get_all(session)
             if result.is_error is True:
                 response.status_code = 500
                 return FuelTypesResponse(code=500, error_desc=result.error_desc)
-            return FuelTypesResponse(code=200, value=FuelType.from_list_to_schema(result.value))
+            with_etag(response, etag)
+            return FuelTypesResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
             return FuelTypesResponse(code=500, error_desc=str(e))
@@ -102,19 +137,21 @@ def init_fuel_type_routes(app: FastAPI):
         session: AsyncSession = Depends(get_session),
     ):
         try:
-            fuel_result = await FuelType.get_by_id(session,data.fuel_type)
-            if fuel_result.is_error:
-                response.status_code = 500
-                return UpdateResponse(code=500, error_desc="Fuel Not Found")
+            # set_price reports a missing fuel type itself, one UPDATE instead
+            # of a lookup first, and puts the new row in fuel_type_cache.
             result = await FuelType.set_price(session,data.fuel_type,data.new_price)
-            if result is False:
+            if result.is_error:
                 response.status_code = 500
                 return UpdateResponse(code=500, error_desc=result.error_desc)
+            if result.value is False:
+                response.status_code = 500
+                return UpdateResponse(code=500, error_desc="Fuel Not Found")
             return UpdateResponse(code=200, value=True)
         except Exception as e:
             response.status_code = 500
             return FuelTypesResponse(code=500, error_desc=str(e))
-        
-    
 
-    
+
+    @app.get("/fuel_types/cache_stats", response_model=CacheStatsResponse)
+    async def cache_stats():
+        return CacheStatsResponse(code=200, value=CacheStatsSchema(**fuel_type_cache.stats()))
@@ -1,12 +1,15 @@
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.fuel_type import FuelType
-from models.station import Station, StationSchema
+from db import DbResult, get_read_session, get_session
+from models.fuel_type import fuel_type_cache
+from models.station import STATION_COLUMNS, Station, StationSchema
+from responses import etag_matches, not_modified, rows_response, with_etag
+from scheduler import reopen_scheduler
+from versions import table_versions
 
 
 class NewStation(BaseModel):
@@ -40,6 +43,21 @@ class DeleteResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+# pylint: disable=E0213,C0115,C0116,W0718
+class CountResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[int] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[int] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class StationResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -82,8 +100,8 @@ def init_stations_routes(app: FastAPI):
     ):
         try:
            
-            fuel_result = await FuelType.get_by_id(session,data.fuel_type)
-            if fuel_result.is_error:
+            fuel_result = await fuel_type_cache.get_by_id(session,data.fuel_type)
+            if fuel_result.is_error or fuel_result.value is None:
                 response.status_code = 500
                 return AddResponse(code=500, error_desc="Fuel Not Found")
             
@@ -102,15 +120,20 @@ def init_stations_routes(app: FastAPI):
 
     @app.get("/stations/get_by_id/{id}", response_model=StationResponse)
     async def get_by_id(
+        request: Request,
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
+            etag = table_versions.etag("stations")
+            if etag_matches(request, etag):
+                return not_modified(etag)
             result: DbResult = await Station.get_by_id(session, id)
             if result.is_error is True:
                 response.status_code = 500
                 return StationResponse(code=500, error_desc=result.error_desc)
+            with_etag(response, etag)
             return StationResponse(code=200, value=Station.from_one_to_schema(result.value))
         except Exception as e:
             response.status_code = 500
@@ -120,15 +143,19 @@ def init_stations_routes(app: FastAPI):
 
     @app.get("/stations/get_all", response_model=StationsResponse)
     async def get_all(
+        request: Request,
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Station.get_all(session)
+            etag = table_versions.etag("stations")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            result: DbResult = await Station.get_all_rows(session)
             if result.is_error is True:
                 response.status_code = 500
                 return StationsResponse(code=500, error_desc=result.error_desc)
-            return StationsResponse(code=200, value=Station.from_list_to_schema(result.value))
+            return with_etag(rows_response(STATION_COLUMNS, result.value), etag)
         except Exception as e:
             response.status_code = 500
             return StationsResponse(code=500, error_desc=str(e))
@@ -148,4 +175,9 @@ def init_stations_routes(app: FastAPI):
             return DeleteResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
-            return DeleteResponse(code=500, error_desc=str(e))
\ No newline at end of file
+            return DeleteResponse(code=500, error_desc=str(e))
+
+
+    @app.get("/stations/pending_reopen", response_model=CountResponse)
+    async def pending_reopen():
+        return CountResponse(code=200, value=reopen_scheduler.pending())
@@ -1,13 +1,15 @@
-
+import asyncio
 import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 from fastapi import Depends, FastAPI, Response
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, confloat
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.transaction import Transaction
+from analytics import ANALYTICS, transaction_analytics
+from db import DbResult, get_read_session
+from models.transaction import SERIES_COLUMNS, Transaction
+from responses import rows_response
 
 
 # pylint: disable=E0213,C0115,C0116,W0718
@@ -25,6 +27,130 @@ class StatsResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+class StatsSchema(BaseModel):
+    count: int = Field(exclude=False, title="count")
+    fuel: float = Field(exclude=False, title="fuel")
+    revenue: float = Field(exclude=False, title="revenue")
+    avg_price: Optional[float] = Field(exclude=False, title="avg_price")
+    p50: Optional[float] = Field(exclude=False, title="p50")
+    p90: Optional[float] = Field(exclude=False, title="p90")
+    p99: Optional[float] = Field(exclude=False, title="p99")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class SummaryResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[StatsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[StatsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+class StatsFilter(BaseModel):
+    station_id: Optional[int] = Field(default=None, exclude=False, title="station_id")
+    date_from: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_from")
+    date_to: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_to")
+
+
+class SeriesPointSchema(BaseModel):
+    station_id: int = Field(exclude=False, title="station_id")
+    bucket: datetime.datetime = Field(exclude=False, title="bucket")
+    fuel: float = Field(exclude=False, title="fuel")
+    revenue: float = Field(exclude=False, title="revenue")
+    count: int = Field(exclude=False, title="count")
+    avg_ticket: float = Field(exclude=False, title="avg_ticket")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class SeriesResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    values: Optional[list[SeriesPointSchema]] = Field(exclude=False, title="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        values: Optional[list[SeriesPointSchema]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, values=values)
+
+
+class SeriesFilter(BaseModel):
+    station_ids: Optional[list[int]] = Field(default=None, exclude=False, title="station_ids")
+    fuel_types: Optional[list[int]] = Field(default=None, exclude=False, title="fuel_types")
+    date_from: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_from")
+    date_to: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_to")
+    bucket: Literal["hour", "day", "week"] = Field(default="day", exclude=False, title="bucket")
+
+
+class GroupFilter(BaseModel):
+    by: Literal["station_id", "fuel_type"] = Field(default="station_id", exclude=False, title="by")
+    column: Literal["price", "fuel_quantity"] = Field(default="price", exclude=False, title="column")
+    percentiles: Optional[list[confloat(ge=0, le=1)]] = Field(default=None, exclude=False, title="percentiles")
+    station_ids: Optional[list[int]] = Field(default=None, exclude=False, title="station_ids")
+    fuel_types: Optional[list[int]] = Field(default=None, exclude=False, title="fuel_types")
+    date_from: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_from")
+    date_to: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date_to")
+
+
+class GroupSchema(BaseModel):
+    station_id: Optional[int] = Field(default=None, exclude=False, title="station_id")
+    fuel_type: Optional[int] = Field(default=None, exclude=False, title="fuel_type")
+    count: int = Field(exclude=False, title="count")
+    fuel: float = Field(exclude=False, title="fuel")
+    revenue: float = Field(exclude=False, title="revenue")
+    avg: float = Field(exclude=False, title="avg")
+    percentiles: dict[str, float] = Field(exclude=False, title="percentiles")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class GroupResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    values: Optional[list[GroupSchema]] = Field(exclude=False, title="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        values: Optional[list[GroupSchema]] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, values=values)
+
+
+class AnalyticsStatsSchema(BaseModel):
+    enabled: bool = Field(exclude=False, title="enabled")
+    rows: int = Field(exclude=False, title="rows")
+    last_id: int = Field(exclude=False, title="last_id")
+    memory_bytes: int = Field(exclude=False, title="memory_bytes")
+    refreshes: int = Field(exclude=False, title="refreshes")
+    last_refresh_rows: int = Field(exclude=False, title="last_refresh_rows")
+    last_refresh_ms: float = Field(exclude=False, title="last_refresh_ms")
+    refresh_total_ms: float = Field(exclude=False, title="refresh_total_ms")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class AnalyticsStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[AnalyticsStatsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[AnalyticsStatsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
 class StationDateFilter(BaseModel):
     station_id: int = Field(exclude=False, title="station_id"),
     date_from: datetime.datetime = Field(exclude=False, title="date_from"),
@@ -39,18 +165,19 @@ def init_stats_routes(app: FastAPI):
     async def get_fuel_by_date(
         response: Response,
         data: StationDateFilter,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result_trans: DbResult = await Transaction.get_by_station_and_time(session,data.station_id,data.date_from,data.date_to)
-            if result_trans.is_error is True:
+            if ANALYTICS:
+                totals = await asyncio.to_thread(
+                    transaction_analytics.totals, data.station_id, data.date_from, data.date_to
+                )
+                return StatsResponse(code=200, value=totals["fuel"])
+            result: DbResult = await Transaction.get_totals(session,data.station_id,data.date_from,data.date_to)
+            if result.is_error is True:
                 response.status_code = 500
-                return StatsResponse(code=500, error_desc=result_trans.error_desc)
-            transactions: list[Transaction] = result_trans.value
-            fuel = 0.0
-            for transaction in transactions:
-                fuel += transaction.fuel_quantity
-            return StatsResponse(code=200, value=fuel)
+                return StatsResponse(code=500, error_desc=result.error_desc)
+            return StatsResponse(code=200, value=result.value["fuel"])
         except Exception as e:
             response.status_code = 500
             return StatsResponse(code=500, error_desc=str(e))
@@ -60,23 +187,101 @@ def init_stats_routes(app: FastAPI):
     async def get_median_price(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result_trans: DbResult = await Transaction.get_by_station(session,id)
-            if result_trans.is_error is True:
+            if ANALYTICS:
+                summary = await asyncio.to_thread(transaction_analytics.summary, id)
+                return StatsResponse(code=200, value=summary["p50"] or 0.0)
+            result: DbResult = await Transaction.get_stats(session, id)
+            if result.is_error is True:
                 response.status_code = 500
-                return StatsResponse(code=500, error_desc=result_trans.error_desc)
-            transactions: list[Transaction] = result_trans.value
-            price = 0.0
-            for transaction in transactions:
-                price += transaction.price
-            if len(transactions):
-                price /= len(transactions)
-            return StatsResponse(code=200, value=price)
+                return StatsResponse(code=500, error_desc=result.error_desc)
+            return StatsResponse(code=200, value=result.value["p50"] or 0.0)
         except Exception as e:
             response.status_code = 500
             return StatsResponse(code=500, error_desc=str(e))
-        
-        
-    
+
+
+    @app.post("/stats/get_summary", response_model=SummaryResponse)
+    async def get_summary(
+        response: Response,
+        data: StatsFilter,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            if ANALYTICS:
+                summary = await asyncio.to_thread(
+                    transaction_analytics.summary, data.station_id, data.date_from, data.date_to
+                )
+                return SummaryResponse(code=200, value=StatsSchema(**summary))
+            result: DbResult = await Transaction.get_stats(session, data.station_id, data.date_from, data.date_to)
+            if result.is_error is True:
+                response.status_code = 500
+                return SummaryResponse(code=500, error_desc=result.error_desc)
+            return SummaryResponse(code=200, value=StatsSchema(**result.value))
+        except Exception as e:
+            response.status_code = 500
+            return SummaryResponse(code=500, error_desc=str(e))
+
+
+    @app.post("/stats/get_series", response_model=SeriesResponse)
+    async def get_series(
+        response: Response,
+        data: SeriesFilter,
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            if ANALYTICS:
+                rows = await asyncio.to_thread(
+                    transaction_analytics.series,
+                    data.bucket,
+                    data.station_ids,
+                    data.fuel_types,
+                    data.date_from,
+                    data.date_to,
+                )
+                return rows_response(SERIES_COLUMNS, rows)
+            result: DbResult = await Transaction.get_series(
+                session, data.bucket, data.station_ids, data.fuel_types, data.date_from, data.date_to
+            )
+            if result.is_error is True:
+                response.status_code = 500
+                return SeriesResponse(code=500, error_desc=result.error_desc)
+            return rows_response(SERIES_COLUMNS, result.value)
+        except Exception as e:
+            response.status_code = 500
+            return SeriesResponse(code=500, error_desc=str(e))
+
+
+    @app.post("/stats/group_by", response_model=GroupResponse)
+    async def group_by(
+        response: Response,
+        data: GroupFilter,
+    ):
+        """Per station or fuel type totals and percentiles, needs ANALYTICS=1."""
+        if not ANALYTICS:
+            response.status_code = 503
+            return GroupResponse(code=503, error_desc="Analytics engine is disabled")
+        try:
+            values = await asyncio.to_thread(
+                transaction_analytics.group_by,
+                data.by,
+                data.column,
+                data.percentiles,
+                data.station_ids,
+                data.fuel_types,
+                data.date_from,
+                data.date_to,
+            )
+            return GroupResponse(code=200, values=[GroupSchema(**value) for value in values])
+        except Exception as e:
+            response.status_code = 500
+            return GroupResponse(code=500, error_desc=str(e))
+
+
+    @app.get("/stats/analytics_stats", response_model=AnalyticsStatsResponse)
+    async def analytics_stats():
+        return AnalyticsStatsResponse(
+            code=200, value=AnalyticsStatsSchema(enabled=ANALYTICS, **transaction_analytics.stats())
+        )
@@ -1,15 +1,23 @@
+import csv
 import datetime
-import threading
+import io
+import json
 from typing import Optional
 
-from fastapi import Depends, FastAPI, Response
+from fastapi import Depends, FastAPI, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db import DbResult, get_session
-from models.fuel_type import FuelType
-from models.station import Station
-from models.transaction import Transaction, TransactionSchema
+from db import DbResult, get_read_session, get_session
+from models.transaction import EXPORT_COLUMNS, Transaction, TransactionSchema
+from responses import rows_response
+from scheduler import reopen_scheduler
+from write_buffer import WRITE_BUFFER, sale_write_buffer
+
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+MAX_BATCH_SIZE = 1000
 
 
 class NewTransaction(BaseModel):
@@ -17,6 +25,14 @@ class NewTransaction(BaseModel):
     fuel_quantity: int = Field(exclude=False, title="fuel_quantity")
     station_id: int = Field(exclude=False, title="station_id")
 
+class BatchTransaction(NewTransaction):
+    date: Optional[datetime.datetime] = Field(default=None, exclude=False, title="date")
+
+
+class NewTransactions(BaseModel):
+    transactions: list[BatchTransaction] = Field(exclude=False, title="transactions", max_length=MAX_BATCH_SIZE)
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class AddResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -31,6 +47,48 @@ class AddResponse(BaseModel):
 
 
 
+# pylint: disable=E0213,C0115,C0116,W0718
+class AddBatchResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[list[AddResponse]] = Field(exclude=False, title="values",serialization_alias="values")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[list[AddResponse]] = [],
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
+class BufferStatsSchema(BaseModel):
+    enabled: bool = Field(exclude=False, title="enabled")
+    interval_ms: float = Field(exclude=False, title="interval_ms")
+    max_rows: int = Field(exclude=False, title="max_rows")
+    pending: int = Field(exclude=False, title="pending")
+    flushes: int = Field(exclude=False, title="flushes")
+    rows: int = Field(exclude=False, title="rows")
+    errors: int = Field(exclude=False, title="errors")
+    avg_batch: float = Field(exclude=False, title="avg_batch")
+    last_flush_ms: float = Field(exclude=False, title="last_flush_ms")
+
+
+# pylint: disable=E0213,C0115,C0116,W0718
+class BufferStatsResponse(BaseModel):
+    code: int = Field(exclude=False, title="code")
+    error_desc: Optional[str] = Field(exclude=False, title="description")
+    value: Optional[BufferStatsSchema] = Field(exclude=False, title="value")
+
+    def __init__(
+        self,
+        code: int = 200,
+        error_desc: Optional[str] = None,
+        value: Optional[BufferStatsSchema] = None,
+    ):
+        super().__init__(code=code, error_desc=error_desc, value=value)
+
+
 # pylint: disable=E0213,C0115,C0116,W0718
 class TransactionResponse(BaseModel):
     code: int = Field(exclude=False, title="code")
@@ -61,6 +119,30 @@ class TransactionsResponse(BaseModel):
         super().__init__(code=code, error_desc=error_desc, value=value)
 
 
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+async def export_chunks(fmt: str, **filters):
+    if fmt == "csv":
+        yield ",".join(EXPORT_COLUMNS) + "\n"
+    date_index = EXPORT_COLUMNS.index("date")
+    async for rows in Transaction.stream_rows(**filters):
+        chunk = io.StringIO()
+        rows = [
+            row[:date_index]
+            + (row[date_index].isoformat() if row[date_index] else None,)
+            + row[date_index + 1:]
+            for row in rows
+        ]
+        if fmt == "csv":
+            csv.writer(chunk, lineterminator="\n").writerows(rows)
+        else:
+            for row in rows:
+                chunk.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+                chunk.write("\n")
+        yield chunk.getvalue()
+
+
 def init_transactions_routes(app: FastAPI):
     @app.post(
         "/transactions/add", response_model=AddResponse, response_model_exclude_none=True
@@ -75,54 +157,55 @@ def init_transactions_routes(app: FastAPI):
             if data.fuel_quantity <= 0:
                 response.status_code = 503
                 return AddResponse(code=503, error_desc="Fuel quantity must be greater than 0")
-            
-            station_result = await Station.get_by_id(session,data.station_id)
-            if not station_result.is_error:
-                if station_result.value.fuel_quantity < data.fuel_quantity:
-                    response.status_code = 501
-                    return AddResponse(code=501, error_desc="Fuel not enough in station")
-
-                if station_result.value.status is False:
-                    response.status_code = 502
-                    return AddResponse(code=502, error_desc="Station status is false")
-                
-
-            fuel_result = await FuelType.get_by_id(session,station_result.value.fuel_type)
-            if fuel_result.is_error:
-                response.status_code = 500
-                return AddResponse(code=500, error_desc="Fuel Not Found")
-            
-            new_transaction = Transaction()
-            new_transaction.number = data.number
-            new_transaction.fuel_quantity = data.fuel_quantity
-            new_transaction.fuel_type = station_result.value.fuel_type
-            new_transaction.price = fuel_result.value.price * new_transaction.fuel_quantity
-            new_transaction.date = datetime.datetime.now()
-            new_transaction.station_id = data.station_id
-            result = await new_transaction.add(session)
-            if result.is_error is True:
-                response.status_code = 500
-                return AddResponse(code=500, error_desc=result.error_desc)
-
 
-            await Station.set_fuel_quantity(session,new_transaction.station_id,-new_transaction.fuel_quantity)
-            await Station.set_active(session,new_transaction.station_id,False)
-            if station_result.value.fuel_quantity -new_transaction.fuel_quantity < 1000:
-                await Station.set_fuel_quantity(session,new_transaction.station_id,1000.0)
-            
+            if WRITE_BUFFER:
+                result = await sale_write_buffer.dispense(data.number, data.station_id, data.fuel_quantity)
+            else:
+                result = await Transaction.dispense(session, data.number, data.station_id, data.fuel_quantity)
+            if result.is_error is True:
+                response.status_code = result.value
+                return AddResponse(code=result.value, error_desc=result.error_desc)
 
-            thread = threading.Thread(target=Station.auto_open,args=(session,data.station_id,))
-            thread.start()
+            reopen_scheduler.schedule(data.station_id)
             return AddResponse(code=200, value=result.value)
         except Exception as e:
             response.status_code = 500
             return AddResponse(code=500, error_desc=str(e))
 
+    @app.post("/transactions/add_batch", response_model=AddBatchResponse)
+    async def add_batch(
+        response: Response,
+        data: NewTransactions,
+        session: AsyncSession = Depends(get_session),
+    ):
+        try:
+            result = await Transaction.add_batch(session, [sale.model_dump() for sale in data.transactions])
+            if result.is_error is True:
+                response.status_code = 500
+                return AddBatchResponse(code=500, error_desc=result.error_desc)
+            return AddBatchResponse(
+                code=200,
+                value=[
+                    AddResponse(code=code, error_desc=error_desc, value=value)
+                    for code, error_desc, value in result.value
+                ],
+            )
+        except Exception as e:
+            response.status_code = 500
+            return AddBatchResponse(code=500, error_desc=str(e))
+
+    @app.get("/transactions/buffer_stats", response_model=BufferStatsResponse)
+    async def buffer_stats():
+        return BufferStatsResponse(
+            code=200,
+            value=BufferStatsSchema(enabled=WRITE_BUFFER, **sale_write_buffer.stats()),
+        )
+
     @app.get("/transactions/get_by_id/{id}", response_model=TransactionResponse)
     async def get_by_id(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
             result: DbResult = await Transaction.get_by_id(session, id)
@@ -134,35 +217,96 @@ def init_transactions_routes(app: FastAPI):
             response.status_code = 500
             return TransactionResponse(code=500, error_desc=str(e))
 
-    @app.get("/transactions/get_by_fuel/{id}", response_model=TransactionResponse)
+    @app.get("/transactions/get_by_fuel/{id}", response_model=TransactionsResponse)
     async def get_by_fuel_type(
         response: Response,
         id: int,
-        session: AsyncSession = Depends(get_session),
+        after_id: Optional[int] = None,
+        limit: int = Query(default=PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Transaction.get_by_id(session, id)
+            result: DbResult = await Transaction.get_by_fuel_type_rows(session, id, after_id, limit)
             if result.is_error is True:
                 response.status_code = 500
-                return TransactionResponse(code=500, error_desc=result.error_desc)
-            return TransactionResponse(code=200, value=Transaction.from_one_to_schema(result.value))
+                return TransactionsResponse(code=500, error_desc=result.error_desc)
+            return rows_response(EXPORT_COLUMNS, result.value)
         except Exception as e:
             response.status_code = 500
-            return TransactionResponse(code=500, error_desc=str(e))
+            return TransactionsResponse(code=500, error_desc=str(e))
+
+    @app.get("/transactions/get_by_station/{id}", response_model=TransactionsResponse)
+    async def get_by_station(
+        response: Response,
+        id: int,
+        after_id: Optional[int] = None,
+        limit: int = Query(default=PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result: DbResult = await Transaction.get_by_station_rows(session, id, after_id, limit)
+            if result.is_error is True:
+                response.status_code = 500
+                return TransactionsResponse(code=500, error_desc=result.error_desc)
+            return rows_response(EXPORT_COLUMNS, result.value)
+        except Exception as e:
+            response.status_code = 500
+            return TransactionsResponse(code=500, error_desc=str(e))
+
+    @app.get("/transactions/get_by_date", response_model=TransactionsResponse)
+    async def get_by_date(
+        response: Response,
+        date_from: datetime.datetime,
+        date_to: datetime.datetime,
+        after_id: Optional[int] = None,
+        limit: int = Query(default=PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        session: AsyncSession = Depends(get_read_session),
+    ):
+        try:
+            result: DbResult = await Transaction.get_by_date_rows(session, date_from, date_to, after_id, limit)
+            if result.is_error is True:
+                response.status_code = 500
+                return TransactionsResponse(code=500, error_desc=result.error_desc)
+            return rows_response(EXPORT_COLUMNS, result.value)
+        except Exception as e:
+            response.status_code = 500
+            return TransactionsResponse(code=500, error_desc=str(e))
 
 
     @app.get("/transactions/get_all", response_model=TransactionsResponse)
     async def get_all(
         response: Response,
-        session: AsyncSession = Depends(get_session),
+        after_id: Optional[int] = None,
+        limit: int = Query(default=PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        session: AsyncSession = Depends(get_read_session),
     ):
         try:
-            result: DbResult = await Transaction.get_all(session)
+            result: DbResult = await Transaction.get_all_rows(session, after_id, limit)
             if result.is_error is True:
                 response.status_code = 500
                 return TransactionsResponse(code=500, error_desc=result.error_desc)
-            result.value.reverse()
-            return TransactionsResponse(code=200, value=Transaction.from_list_to_schema(result.value))
+            return rows_response(EXPORT_COLUMNS, result.value)
         except Exception as e:
             response.status_code = 500
             return TransactionsResponse(code=500, error_desc=str(e))
+
+
+    @app.get("/transactions/export")
+    async def export(
+        fmt: str = Query(default="ndjson", alias="format", pattern="^(ndjson|csv)$"),
+        station_id: Optional[int] = None,
+        fuel_type: Optional[int] = None,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ):
+        return StreamingResponse(
+            export_chunks(
+                fmt,
+                station_id=station_id,
+                fuel_type=fuel_type,
+                date_from=date_from,
+                date_to=date_to,
+            ),
+            media_type=EXPORT_MEDIA_TYPES[fmt],
+            headers={"Content-Disposition": f"attachment; filename=transactions.{fmt}"},
+        )
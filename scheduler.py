@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import heapq
+import time
+from typing import Optional
+
+from db import async_session
+from models.station import REOPEN_DELAY, Station
+
+
+# pylint: disable=C0115,C0116,W0718
+class ReopenScheduler:
+    """Reopens stations after a sale from one task on the app's event loop.
+
+    Deadlines live in a min-heap. Scheduling a station that is already
+    pending only moves its deadline, the stale heap entry is skipped when
+    it is popped, so the heap never holds more than one live entry per
+    station.
+    """
+
+    def __init__(self, delay: float = REOPEN_DELAY):
+        self.delay = delay
+        self._heap: list[tuple[float, int]] = []
+        self._deadlines: dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def pending(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, station_id: int, delay: Optional[float] = None):
+        self._push(station_id, self.delay if delay is None else delay)
+        self.start()
+        self._wakeup.set()
+
+    def _push(self, station_id: int, delay: float):
+        deadline = time.monotonic() + delay
+        self._deadlines[station_id] = deadline
+        heapq.heappush(self._heap, (deadline, station_id))
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def recover(self):
+        """Picks up the deadlines sales stored in stations.reopen_at.
+
+        Stations whose deadline passed while no worker ran are reopened,
+        the others are queued for the time they have left. Stations closed
+        for any other reason stay closed. Call start() afterwards.
+        """
+        async with async_session() as session:
+            result = await Station.reopen_due(session)
+            if result.is_error:
+                print(f"Error reopen stations: {result.error_desc}")
+            result = await Station.get_pending_reopens(session)
+        if result.is_error:
+            print(f"Error load reopen deadlines: {result.error_desc}")
+            return
+        now = datetime.datetime.now()
+        for station_id, reopen_at in result.value:
+            self._push(station_id, max(0.0, (reopen_at - now).total_seconds()))
+
+    def _pop_due(self) -> tuple[list[int], Optional[float]]:
+        now = time.monotonic()
+        due = []
+        while self._heap:
+            deadline, station_id = self._heap[0]
+            if self._deadlines.get(station_id) != deadline:
+                heapq.heappop(self._heap)
+                continue
+            if deadline > now:
+                return due, deadline - now
+            heapq.heappop(self._heap)
+            del self._deadlines[station_id]
+            due.append(station_id)
+        return due, None
+
+    async def _run(self):
+        while True:
+            due, timeout = self._pop_due()
+            for station_id in due:
+                await self._reopen(station_id)
+            if due:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reopen(self, station_id: int):
+        try:
+            async with async_session() as session:
+                result = await Station.set_active(session, station_id, True)
+            if result.is_error:
+                print(f"Error reopen station {station_id}: {result.error_desc}")
+        except Exception as e:
+            print(f"Error reopen station {station_id}: {e}")
+
+
+reopen_scheduler = ReopenScheduler()
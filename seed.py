@@ -0,0 +1,150 @@
+"""Deterministic synthetic data for load and scale tests.
+
+    python main.py seed --stations 200 --transactions 20000000 --seed 1
+
+The same seed, counts and --end date always produce the same rows.
+Sales follow a daily traffic curve with weekend and station popularity
+skew, litres are log-normal, and prices drift upwards over the period.
+Rows go in through COPY on Postgres and multi-row driver-level inserts
+elsewhere, then the hourly rollups are rebuilt.
+"""
+import datetime
+import math
+import random
+import time
+from typing import Iterator, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from models.fuel_type import FuelType, fuel_type_cache
+from models.station import Station
+from migrations import BASE_FUELS, migrate
+from models.transaction import EXPORT_COLUMNS, Transaction
+
+# Share of a day's sales per hour, quiet at night, peaks at 8 and 18.
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 7, 9, 7, 6, 6, 6, 6, 6, 6, 7, 9, 9, 7, 5, 3, 2, 1]
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.15, 1.25, 0.9]
+YEARLY_PRICE_DRIFT = 0.08
+TRANSACTION_COLUMNS = [column for column in EXPORT_COLUMNS if column != "id"]
+
+
+def daily_counts(transactions: int, days: int, start: datetime.datetime) -> list[int]:
+    weights = [WEEKDAY_WEIGHTS[(start + datetime.timedelta(days=day)).weekday()] for day in range(days)]
+    total = sum(weights)
+    counts = [math.floor(transactions * weight / total) for weight in weights]
+    for day in range(transactions - sum(counts)):
+        counts[day % days] += 1
+    return counts
+
+
+def plate(rng: random.Random) -> str:
+    letters = "ABEKMHOPCTYX"
+    return f"{rng.choice(letters)}{rng.randint(1, 999):03d}{rng.choice(letters)}{rng.choice(letters)}"
+
+
+def generate_sales(
+    rng: random.Random,
+    stations: list[tuple[int, int]],
+    prices: dict[int, float],
+    transactions: int,
+    start: datetime.datetime,
+    days: int,
+) -> Iterator[tuple]:
+    """Yields (number, fuel_quantity, fuel_type, price, date, station_id) in date order."""
+    station_weights = [1 / math.sqrt(rank + 1) for rank in range(len(stations))]
+    plates = [plate(rng) for _ in range(max(100, transactions // 20))]
+    for day, count in enumerate(daily_counts(transactions, days, start)):
+        day_start = start + datetime.timedelta(days=day)
+        drift = 1 + YEARLY_PRICE_DRIFT * day / 365
+        hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+        offsets = sorted(hour * 3600 + rng.random() * 3600 for hour in hours)
+        picked = rng.choices(stations, weights=station_weights, k=count)
+        for offset, (station_id, fuel_type) in zip(offsets, picked):
+            litres = round(min(80.0, max(5.0, rng.lognormvariate(3.5, 0.35))), 2)
+            yield (
+                rng.choice(plates),
+                litres,
+                fuel_type,
+                round(litres * prices[fuel_type] * drift, 2),
+                day_start + datetime.timedelta(seconds=offset),
+                station_id,
+            )
+
+
+async def copy_rows(conn: AsyncConnection, rows: list[tuple]):
+    dialect_name = conn.dialect.name
+    if dialect_name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Transaction.__tablename__, records=rows, columns=TRANSACTION_COLUMNS
+        )
+    elif dialect_name == "sqlite":
+        placeholders = ", ".join("?" for _ in TRANSACTION_COLUMNS)
+        await conn.exec_driver_sql(
+            f"INSERT INTO {Transaction.__tablename__} ({', '.join(TRANSACTION_COLUMNS)}) VALUES ({placeholders})",
+            [row[:4] + (row[4].strftime("%Y-%m-%d %H:%M:%S.%f"),) + row[5:] for row in rows],
+        )
+    else:
+        await conn.execute(insert(Transaction), [dict(zip(TRANSACTION_COLUMNS, row)) for row in rows])
+
+
+async def seed_data(
+    engine: AsyncEngine,
+    stations: int,
+    transactions: int,
+    seed: int = 1,
+    days: int = 365,
+    end: Optional[datetime.date] = None,
+    batch_size: int = 50000,
+) -> dict:
+    rng = random.Random(seed)
+    end = end or datetime.date.today()
+    start = datetime.datetime.combine(end, datetime.time()) - datetime.timedelta(days=days)
+    started = time.perf_counter()
+    await migrate(engine)
+
+    async with engine.begin() as conn:
+        if not (await conn.execute(select(func.count(FuelType.id)))).scalar():
+            await conn.execute(insert(FuelType), [{"price": price, "fuel_name": name} for price, name in BASE_FUELS])
+        prices = {row.id: row.price for row in await conn.execute(select(FuelType.id, FuelType.price))}
+        fuel_types = sorted(prices)
+        if stations:
+            await conn.execute(
+                insert(Station),
+                [
+                    {
+                        "fuel_type": rng.choice(fuel_types),
+                        "fuel_quantity": float(rng.randint(5000, 20000)),
+                        "status": True,
+                    }
+                    for _ in range(stations)
+                ],
+            )
+        result = await conn.execute(select(Station.id, Station.fuel_type).order_by(Station.id))
+        all_stations = [tuple(row) for row in result]
+    fuel_type_cache.invalidate()
+
+    batch = []
+    for row in generate_sales(rng, all_stations, prices, transactions, start, days):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            async with engine.begin() as conn:
+                await copy_rows(conn, batch)
+            batch = []
+    if batch:
+        async with engine.begin() as conn:
+            await copy_rows(conn, batch)
+    inserted_at = time.perf_counter()
+
+    async with AsyncSession(engine) as session:
+        rollups = await Transaction.rebuild_rollups(session)
+    if rollups.is_error:
+        raise RuntimeError(rollups.error_desc)
+    return {
+        "stations": len(all_stations),
+        "transactions": transactions,
+        "rollups": rollups.value,
+        "insert_seconds": inserted_at - started,
+        "total_seconds": time.perf_counter() - started,
+    }
@@ -1,23 +1,28 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
-from sqlalchemy.ext.asyncio import AsyncEngine
 
-from db import engine
-from models.fuel_type import FuelType, init_fuel_type
-from models.station import Station, init_station
-from models.transaction import init_transaction
+from analytics import ANALYTICS, transaction_analytics
+from db import async_session, engine, read_engine
+from metrics import MetricsMiddleware, QueryCounterMiddleware, monitor_loop_lag
+from migrations import prepare_database
+from models.transaction import Transaction
 
 # pylint: disable=E0401
+from routes.admin import init_admin_routes
+from routes.events import init_events_routes
 from routes.fuel_type import init_fuel_type_routes
 from routes.station import init_stations_routes
 from routes.stats import init_stats_routes
 from routes.transaction import init_transactions_routes
+from scheduler import reopen_scheduler
+from write_buffer import sale_write_buffer
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
@@ -26,7 +31,30 @@ if os.path.exists(dotenv_path):
 
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # db.engine serves the writes of routes, init_models and the
+    # background jobs, db.read_engine the GET routes. They are built when
+    # db is imported, not here: main.py's commands and the tests use them
+    # without the app. Neither connects before its first query, and both
+    # are disposed when the app stops.
+    await init_models()
+    await reopen_scheduler.recover()
+    reopen_scheduler.start()
+    if ANALYTICS:
+        transaction_analytics.start()
+    loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    yield
+    loop_lag_task.cancel()
+    await transaction_analytics.stop()
+    await sale_write_buffer.stop()
+    await reopen_scheduler.stop()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -37,9 +65,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryCounterMiddleware)
 
 
 def custom_openapi():
@@ -57,52 +84,34 @@ def custom_openapi():
 
 async def init_models():
     try:
-        if os.environ.get("REINIT_DB") == "1":
-            await init_fuel_type(engine)
-            await init_station(engine)
-            await init_transaction(engine)
-            await init_base_vars(engine)
+        applied, seeded = await prepare_database(engine)
+        if applied:
+            print(f"Applied migrations {applied}\n")
+        if seeded:
+            print("Added base fuel types and stations\n")
         print("Done\n")
     except Exception as e:
         print(e)
 
-async def init_base_vars(engine: AsyncEngine):
-    try:
-        fuels = [
-            [43,"АИ-92"],
-            [45,"АИ-95"],
-            [47,"АИ-100"],
-            [55,"Дизель"],
-        ]
-        for fuel in fuels:
-            fuel_temp = FuelType()
-            fuel_temp.price = fuel[0]
-            fuel_temp.fuel_name = fuel[1]
-            async with engine.connect() as conn:
-                result = await fuel_temp.add(conn)
-                if result.is_error:
-                    print("Error create fuel_types\n")
-        
-        for station in range(4):
-            station_temp = Station()
-            station_temp.fuel_type = station+1
-            station_temp.fuel_quantity = (10000 - 123*station)
-            station_temp.status = True
-            async with engine.connect() as conn:
-                result = await station_temp.add_first(conn)
-                if result.is_error:
-                    print("Error create stations\n")
-
-        print("Done\n")
-
-    except Exception as e:
-        print(e)
+async def backfill_rollups():
+    async with async_session() as session:
+        result = await Transaction.rebuild_rollups(session)
+    if result.is_error:
+        print(f"Error backfill rollups: {result.error_desc}")
+    else:
+        print(f"Backfilled {result.value} hourly rollups\n")
 
 
-def run():
+def init_routes():
     init_fuel_type_routes(app)
     init_stations_routes(app)
     init_transactions_routes(app)
     init_stats_routes(app)
+    init_events_routes(app)
+    init_admin_routes(app)
     app.openapi_schema = custom_openapi()
+
+
+def run():
+    init_routes()
     uvicorn.run(app, host=os.environ.get("HOST"), port=int(os.environ.get("PORT")))
@@ -0,0 +1,188 @@
+"""Log of slow SQL statements with the plan of each statement shape.
+
+Statements taking SLOW_QUERY_MS or longer are appended as JSON lines to
+SLOW_QUERY_LOG, rotated at SLOW_QUERY_LOG_BYTES with
+SLOW_QUERY_LOG_BACKUPS old files kept. A record holds the statement,
+its parameters, the project function that ran it (models/ ones first)
+and the request route. The first slow run of each statement shape also
+gets EXPLAIN (EXPLAIN QUERY PLAN on SQLite) output. /admin/slow_queries
+lists the shapes by total time.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+import orjson
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from metrics import request_route
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", os.path.join(ROOT, "logs", "slow_queries.jsonl"))
+SLOW_QUERY_LOG_BYTES = int(os.environ.get("SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", "5"))
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN ", "mysql": "EXPLAIN "}
+# EXPLAIN only takes these; it plans them without running them.
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s")
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+VALUES_LIST = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with IN lists and multi-row VALUES folded to one ?.
+
+    Keeps one entry per query in the code however many ids it gets.
+    """
+    shape = PLACEHOLDER.sub("?", statement)
+    shape = PLACEHOLDER_LIST.sub("?", shape)
+    shape = VALUES_LIST.sub("(?)", shape)
+    return " ".join(shape.split())
+
+
+def project_frame(frame) -> Optional[str]:
+    path = frame.f_code.co_filename
+    if not path.startswith(ROOT) or "site-packages" in path or path == __file__:
+        return None
+    return f"{os.path.relpath(path, ROOT)}:{frame.f_code.co_qualname}"
+
+
+def caller() -> Optional[str]:
+    """The innermost project function running the statement.
+
+    Listeners run in SQLAlchemy's greenlet, the coroutines that awaited
+    it (the model method, the route) are on the parent greenlet's stack.
+    """
+    frames = []
+    frame = sys._getframe(1)
+    parent = getcurrent().parent
+    for top in (frame, parent.gr_frame if parent is not None else None):
+        while top is not None:
+            name = project_frame(top)
+            if name is not None:
+                frames.append(name)
+            top = top.f_back
+    for name in frames:
+        if name.startswith("models" + os.sep):
+            return name
+    return frames[0] if frames else None
+
+
+def explain(conn, statement: str, parameters) -> Optional[list[str]]:
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    # A raw cursor, so the EXPLAIN is neither timed nor logged itself.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+
+
+# pylint: disable=C0115,C0116,W0718
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        path: str = SLOW_QUERY_LOG,
+        max_bytes: int = SLOW_QUERY_LOG_BYTES,
+        backups: int = SLOW_QUERY_LOG_BACKUPS,
+    ):
+        self.threshold_ms = threshold_ms
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.shapes: dict[str, dict] = {}
+        self._logger: Optional[logging.Logger] = None
+
+    def instrument(self, async_engine: AsyncEngine, name: str):
+        sync_engine = async_engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get("slow_query_start")
+            if not starts:
+                return
+            elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+            if elapsed_ms >= self.threshold_ms:
+                try:
+                    self.record(name, conn, statement, parameters, context, executemany, elapsed_ms)
+                except Exception as e:
+                    print(f"Error slow query log: {e}")
+
+        @event.listens_for(sync_engine, "handle_error")
+        def handle_error(context):
+            starts = context.connection.info.get("slow_query_start") if context.connection else None
+            if starts:
+                starts.pop()
+
+    def record(self, engine_name: str, conn, statement: str, parameters, context, executemany: bool, elapsed_ms: float):
+        text = statement_shape(statement)
+        shape = self.shapes.get(text)
+        record = {
+            "time": datetime.datetime.now(),
+            "engine": engine_name,
+            "ms": round(elapsed_ms, 3),
+            "shape": hashlib.sha1(text.encode()).hexdigest()[:12],
+            "statement": statement,
+            "params": parameters[0] if executemany and parameters else parameters,
+            "method": caller(),
+            "route": request_route.get(),
+        }
+        if executemany:
+            record["executemany"] = len(parameters)
+        if shape is None:
+            # Streamed results still hold the cursor, and an executemany
+            # has no single parameter set to plan with.
+            streaming = context is not None and context.execution_options.get("stream_results")
+            plan = None if executemany or streaming else explain(conn, statement, parameters)
+            record["plan"] = plan
+            shape = self.shapes[text] = {
+                "shape": record["shape"],
+                "statement": text,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": plan,
+            }
+        shape["count"] += 1
+        shape["total_ms"] += elapsed_ms
+        shape["max_ms"] = max(shape["max_ms"], elapsed_ms)
+        shape["method"] = record["method"]
+        shape["route"] = record["route"]
+        self.logger().info(orjson.dumps(record, default=str).decode())
+
+    def logger(self) -> logging.Logger:
+        if self._logger is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            # Not registered with logging, so it only writes to this file.
+            logger = logging.Logger("slow_queries", logging.INFO)
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def top(self, limit: int = 20) -> list[dict]:
+        shapes = sorted(self.shapes.values(), key=lambda shape: shape["total_ms"], reverse=True)
+        return [{**shape, "avg_ms": shape["total_ms"] / shape["count"]} for shape in shapes[:limit]]
+
+
+slow_query_log = SlowQueryLog()
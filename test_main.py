@@ -1,36 +1,72 @@
+import asyncio
 import datetime
 import json
 import os
+import random
+from typing import Optional
 
+import pytest
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.testclient import TestClient
-from fastapi_async_sqlalchemy import SQLAlchemyMiddleware
-
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from analytics import TransactionAnalytics
+from archive import archive_month
+from broadcast import BroadcastHub, hub
+from db import Base, DbResult, async_session, engine
+from metrics import MetricsMiddleware, QueryCounterMiddleware
+from migrations import prepare_database
+from models.archive import ArchivedMonth
+from models.fuel_type import FuelType, fuel_type_cache
+from models.station import Station
+from models.transaction import Transaction
+from routes.admin import init_admin_routes
+from routes.events import init_events_routes
 from routes.fuel_type import init_fuel_type_routes
 from routes.station import init_stations_routes
 from routes.stats import init_stats_routes
 from routes.transaction import init_transactions_routes
+from scheduler import ReopenScheduler, reopen_scheduler
+from seed import generate_sales
+from slow_queries import slow_query_log, statement_shape
+from write_buffer import SaleWriteBuffer, sale_write_buffer
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryCounterMiddleware, headers=True)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-app.add_middleware(SQLAlchemyMiddleware, db_url=os.environ["DATABASE_URL"])
 
 init_fuel_type_routes(app)
 init_stations_routes(app)
 init_transactions_routes(app)
 init_stats_routes(app)
+init_events_routes(app)
+init_admin_routes(app)
 
 
 client = TestClient(app)
 auth = ""
 
 
+async def reopen_all_stations():
+    # Stations closed by the previous run may still have a deadline ahead.
+    async with async_session() as session:
+        await session.execute(update(Station).values(status=True, reopen_at=None))
+        await session.commit()
+
+
+def setup_module():
+    asyncio.run(prepare_database(engine))
+    asyncio.run(reopen_all_stations())
+
+
 def test_add_station():
     test_data = {"fuel_type": 2}
     post_data = json.dumps(test_data)
@@ -89,6 +125,15 @@ def test_update_fuel_price():
 
 
 
+def test_fuel_cache_stats():
+    client.get("/fuel_types/get_by_id/1")
+    response = client.get("/fuel_types/cache_stats")
+    print(response.json())
+    assert response.json()["code"] == 200
+    assert response.json()["value"]["hits"] > 0
+    assert response.json()["value"]["size"] > 0
+
+
 def test_transactions_add():
     test_data = {"number": "125XFS", "fuel_quantity": 30, "station_id": 1}
     post_data = json.dumps(test_data)
@@ -99,6 +144,207 @@ def test_transactions_add():
     assert response.json()["value"] is not None
 
 
+def test_pending_reopen():
+    response = client.get("/stations/pending_reopen")
+    print(response.json())
+    assert response.json()["code"] == 200
+    assert response.json()["value"] >= 1
+
+
+def test_transactions_add_batch():
+    test_data = {
+        "transactions": [
+            {"number": "125XFS", "fuel_quantity": 10, "station_id": 2},
+            {"number": "125XFS", "fuel_quantity": 0, "station_id": 2},
+            {"number": "A001AA", "fuel_quantity": 15, "station_id": 3, "date": "2024-03-08T12:30:00"},
+            {"number": "A001AA", "fuel_quantity": 15, "station_id": 100000},
+        ]
+    }
+    post_data = json.dumps(test_data)
+    response = client.post(
+        "/transactions/add_batch", data=post_data
+    )
+    print(response.json())
+    assert response.json()["code"] == 200
+    values = response.json()["values"]
+    assert [value["code"] for value in values] == [200, 503, 200, 500]
+    assert values[0]["value"] < values[2]["value"]
+
+
+def test_write_buffer_group_commit():
+    async def sell():
+        buffer = SaleWriteBuffer(interval_ms=50, max_rows=10)
+        results = await asyncio.gather(
+            buffer.dispense("125XFS", 2, 10),
+            buffer.dispense("125XFS", 2, 10),
+            buffer.dispense("125XFS", 3, 10),
+        )
+        await buffer.stop()
+        return results, buffer.stats()
+
+    results, stats = asyncio.run(sell())
+    assert [result.is_error for result in results] == [False, True, False]
+    assert results[1].value == 502
+    assert stats["flushes"] == 1
+    assert stats["rows"] == 3
+
+
+def add_station(fuel_type: int = 1, fuel_quantity: Optional[float] = None) -> int:
+    station_id = client.post("/stations/add", data=json.dumps({"fuel_type": fuel_type})).json()["value"]
+    if fuel_quantity is not None:
+        async def set_quantity():
+            async with async_session() as session:
+                await session.execute(update(Station).where(Station.id == station_id).values(fuel_quantity=fuel_quantity))
+                await session.commit()
+
+        asyncio.run(set_quantity())
+    return station_id
+
+
+def get_station(station_id: int) -> dict:
+    return client.get(f"/stations/get_by_id/{station_id}").json()["value"]
+
+
+def test_write_buffer_rolls_back_failed_sale(monkeypatch):
+    good, bad = add_station(1, 2000), add_station(2, 2000)
+    get_by_id = fuel_type_cache.get_by_id
+
+    async def fail_for_fuel_2(session, fueltype_id):
+        if fueltype_id == 2:
+            return DbResult.error("lookup failed")
+        return await get_by_id(session, fueltype_id)
+
+    monkeypatch.setattr(fuel_type_cache, "get_by_id", fail_for_fuel_2)
+
+    async def sell():
+        buffer = SaleWriteBuffer(interval_ms=50, max_rows=10)
+        results = await asyncio.gather(buffer.dispense("125XFS", good, 10), buffer.dispense("125XFS", bad, 10))
+        await buffer.stop()
+        return results
+
+    results = asyncio.run(sell())
+    assert [result.is_error for result in results] == [False, True]
+    assert get_station(good)["fuel_quantity"] == 1990 and get_station(good)["status"] is False
+    # The failed sale's station UPDATE is rolled back, not committed with the batch.
+    assert get_station(bad)["fuel_quantity"] == 2000 and get_station(bad)["status"] is True
+
+
+
+def sell(station_id: int, fuel_quantity: int) -> dict:
+    data = {"number": "125XFS", "fuel_quantity": fuel_quantity, "station_id": station_id}
+    return client.post("/transactions/add", data=json.dumps(data)).json()
+
+
+def set_station(station_id: int, **values):
+    async def run():
+        async with async_session() as session:
+            await session.execute(update(Station).where(Station.id == station_id).values(**values))
+            await session.commit()
+
+    asyncio.run(run())
+
+
+def get_reopen_at(station_id: int) -> Optional[datetime.datetime]:
+    async def run():
+        async with async_session() as session:
+            return (await session.execute(select(Station.reopen_at).where(Station.id == station_id))).scalar()
+
+    return asyncio.run(run())
+
+
+def test_dispense_decrements_and_closes():
+    station_id = add_station(1, 2000)
+    before = datetime.datetime.now()
+    assert sell(station_id, 30)["code"] == 200
+    assert get_station(station_id)["fuel_quantity"] == 1970
+    assert get_station(station_id)["status"] is False
+    assert get_reopen_at(station_id) > before
+
+
+def test_dispense_refills_below_threshold():
+    station_id = add_station(1, 1050)
+    assert sell(station_id, 100)["code"] == 200
+    assert get_station(station_id)["fuel_quantity"] == 1950
+    assert get_station(station_id)["status"] is False
+
+
+def test_dispense_over_capacity():
+    station_id = add_station(1, 20)
+    assert sell(station_id, 30)["code"] == 501
+    assert get_station(station_id)["fuel_quantity"] == 20
+    assert get_station(station_id)["status"] is True
+    assert get_reopen_at(station_id) is None
+
+
+def test_dispense_closed_station():
+    station_id = add_station(1, 2000)
+    set_station(station_id, status=False)
+    assert sell(station_id, 30)["code"] == 502
+    assert get_station(station_id)["fuel_quantity"] == 2000
+    assert get_station(station_id)["status"] is False
+    assert get_reopen_at(station_id) is None
+
+
+def test_concurrent_dispense_sells_once():
+    station_id = add_station(1, 2000)
+
+    async def sale():
+        async with async_session() as session:
+            return await Transaction.dispense(session, "125XFS", station_id, 30)
+
+    async def race():
+        return await asyncio.gather(sale(), sale())
+
+    results = asyncio.run(race())
+    assert sorted(result.value if result.is_error else 200 for result in results) == [200, 502]
+    assert get_station(station_id)["fuel_quantity"] == 1970
+    assert get_station(station_id)["status"] is False
+
+
+def test_recover_keeps_pending_deadlines():
+    now = datetime.datetime.now()
+    due, pending, manual = add_station(), add_station(), add_station()
+    set_station(due, status=False, reopen_at=now - datetime.timedelta(seconds=1))
+    set_station(pending, status=False, reopen_at=now + datetime.timedelta(hours=1))
+    set_station(manual, status=False)
+
+    scheduler = ReopenScheduler()
+    asyncio.run(scheduler.recover())
+    assert get_station(due)["status"] is True
+    assert get_reopen_at(due) is None
+    assert get_station(pending)["status"] is False
+    assert get_station(manual)["status"] is False
+    assert pending in scheduler._deadlines
+    assert due not in scheduler._deadlines and manual not in scheduler._deadlines
+
+def test_write_buffer_publishes_accepted_sales():
+    first, closed, last = add_station(1, 2000), add_station(1, 2000), add_station(1, 2000)
+    set_station(closed, status=False)
+
+    async def run():
+        stream = hub.stream([first, closed, last])
+        await stream.__anext__()
+        buffer = SaleWriteBuffer(interval_ms=50, max_rows=10)
+        results = await asyncio.gather(*[buffer.dispense("125XFS", station_id, 10) for station_id in (first, closed, last)])
+        await buffer.stop()
+        messages = [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(2)]
+        # Nothing else is queued: the rejected sale published nothing.
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(stream.__anext__(), 0.1)
+        return results, messages
+
+    results, messages = asyncio.run(run())
+    assert [result.is_error for result in results] == [False, True, False]
+    assert [json.loads(message.split(b"data: ")[1])["id"] for message in messages] == [first, last]
+
+
+def test_buffer_stats():
+    response = client.get("/transactions/buffer_stats")
+    print(response.json())
+    assert response.json()["code"] == 200
+    assert response.json()["value"]["max_rows"] > 0
+
+
 def test_transaction_get_by_id():
     response = client.get(
         "/transactions/get_by_id/1"
@@ -115,6 +361,80 @@ def test_get_all_transactions():
     assert response.json()["values"] is not None
 
 
+def test_get_all_transactions_page():
+    response = client.get(
+        "/transactions/get_all?limit=1"
+    )
+    assert response.json()["code"] == 200
+    values = response.json()["values"]
+    assert len(values) == 1
+    last_id = values[0]["id"]
+    response_2 = client.get(
+        f"/transactions/get_all?limit=1&after_id={last_id}"
+    )
+    assert response_2.json()["code"] == 200
+    for value in response_2.json()["values"]:
+        assert value["id"] < last_id
+
+
+def test_get_transactions_by_fuel():
+    response = client.get(
+        "/transactions/get_by_fuel/1?limit=10"
+    )
+    assert response.json()["code"] == 200
+    assert len(response.json()["values"]) <= 10
+    for value in response.json()["values"]:
+        assert value["fuel_type"] == 1
+
+
+def test_get_transactions_by_station_page():
+    station_id = add_station()
+    sales = [{"number": "A004AA", "fuel_quantity": 10, "station_id": station_id} for _ in range(3)]
+    client.post("/transactions/add_batch", data=json.dumps({"transactions": sales}))
+    first = client.get(f"/transactions/get_by_station/{station_id}?limit=2").json()["values"]
+    assert len(first) == 2 and first[0]["id"] > first[1]["id"]
+    rest = client.get(f"/transactions/get_by_station/{station_id}?limit=2&after_id={first[-1]['id']}").json()["values"]
+    assert len(rest) == 1 and rest[0]["id"] < first[-1]["id"]
+    assert {value["station_id"] for value in first + rest} == {station_id}
+
+
+def test_get_transactions_by_date_page():
+    station_id = add_station()
+    # A day no other run writes to.
+    day = datetime.datetime(2003, 1, 1) + datetime.timedelta(days=station_id)
+    dates = [(day + datetime.timedelta(hours=hour)).isoformat() for hour in (8, 9, 9)]
+    sales = [{"number": "A005AA", "fuel_quantity": 10, "station_id": station_id, "date": date} for date in dates]
+    client.post("/transactions/add_batch", data=json.dumps({"transactions": sales}))
+    window = f"date_from={day.isoformat()}&date_to={(day + datetime.timedelta(hours=23)).isoformat()}"
+    first = client.get(f"/transactions/get_by_date?{window}&limit=2").json()["values"]
+    # Newest first, ties on date broken by id.
+    assert [value["date"] for value in first] == [dates[1], dates[1]]
+    assert first[0]["id"] > first[1]["id"]
+    rest = client.get(f"/transactions/get_by_date?{window}&limit=2&after_id={first[-1]['id']}").json()["values"]
+    assert [value["date"] for value in rest] == [dates[0]]
+
+
+def test_export_transactions_ndjson():
+    response = client.get(
+        "/transactions/export?station_id=1"
+    )
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert len(lines) > 0
+    for line in lines:
+        assert json.loads(line)["station_id"] == 1
+
+
+def test_export_transactions_csv():
+    response = client.get(
+        "/transactions/export?format=csv"
+    )
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == "id,number,fuel_quantity,fuel_type,price,date,station_id"
+    assert len(lines) > 1
+
+
 def test_get_median_price():
     response = client.get(
         "/stats/get_median_price/1"
@@ -135,3 +455,327 @@ def test_get_all_fuel():
     assert response.json()["value"] is not None
 
 
+def test_get_summary():
+    test_data = {"station_id": 1}
+    post_data = json.dumps(test_data)
+    response = client.post(
+        "/stats/get_summary", data=post_data
+    )
+    print(response.json())
+    assert response.json()["code"] == 200
+    value = response.json()["value"]
+    assert value["count"] > 0
+    assert value["p50"] <= value["p90"] <= value["p99"]
+
+
+def test_pool_stats():
+    response = client.get("/admin/pool_stats")
+    print(response.json())
+    assert response.json()["code"] == 200
+    assert response.json()["value"]["write"]["checkouts"] > 0
+    assert response.json()["value"]["read"]["checkouts"] > 0
+
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{method="GET",route="/stations/get_by_id/{id}",status="200"}' in response.text
+    assert 'db_query_duration_seconds_count{engine="write"}' in response.text
+    assert "station_reopen_pending" in response.text
+    assert f"write_buffer_interval_ms {sale_write_buffer.interval_ms}" in response.text
+    assert f"write_buffer_max_rows {sale_write_buffer.max_rows}" in response.text
+    assert "write_buffer_flush_errors_total " in response.text
+
+
+def test_seed_is_deterministic():
+    def sample(seed):
+        start = datetime.datetime(2024, 1, 1)
+        return list(generate_sales(random.Random(seed), [(1, 1), (2, 2)], {1: 43, 2: 45}, 500, start, 7))
+
+    rows = sample(3)
+    assert rows == sample(3)
+    assert rows != sample(4)
+    assert len(rows) == 500
+    assert [row[4] for row in rows] == sorted(row[4] for row in rows)
+
+
+def test_get_series():
+    test_data = {"station_ids": [1], "bucket": "day"}
+    response = client.post("/stats/get_series", data=json.dumps(test_data))
+    print(response.json())
+    assert response.json()["code"] == 200
+    values = response.json()["values"]
+    assert values and all(value["station_id"] == 1 for value in values)
+    summary = client.post("/stats/get_summary", data=json.dumps({"station_id": 1})).json()["value"]
+    assert sum(value["count"] for value in values) == summary["count"]
+
+
+def test_stations_etag():
+    response = client.get("/stations/get_all")
+    etag = response.headers["etag"]
+    response = client.get("/stations/get_all", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    response = client.get("/stations/get_by_id/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    client.post("/stations/add", data=json.dumps({"fuel_type": 1}))
+    response = client.get("/stations/get_all", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_fuel_types_etag():
+    etag = client.get("/fuel_types/get_all").headers["etag"]
+    assert client.get("/fuel_types/get_by_id/1", headers={"If-None-Match": etag}).status_code == 304
+    client.put("/fuel_types/update_price", data=json.dumps({"fuel_type": 1, "new_price": 43}))
+    response = client.get("/fuel_types/get_all", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_broadcast_on_commit():
+    async def change_price():
+        subscription = hub.subscribe([1])
+        try:
+            async with async_session() as session:
+                await FuelType.set_price(session, 1, 43)
+            return subscription.queue.get_nowait()
+        finally:
+            hub.unsubscribe(subscription)
+
+    message = asyncio.run(change_price())
+    assert message.startswith(b"event: fuel_type\n")
+    assert b'"price":43' in message
+
+
+def test_broadcast_drops_oldest():
+    broadcast_hub = BroadcastHub(queue_size=2)
+    subscription = broadcast_hub.subscribe([1])
+    for quantity in range(3):
+        broadcast_hub.publish("station", {"id": 1, "fuel_quantity": quantity})
+    broadcast_hub.publish("station", {"id": 2, "fuel_quantity": 0})
+    assert subscription.dropped == 1
+    assert b'"fuel_quantity":1' in subscription.queue.get_nowait()
+    assert b'"fuel_quantity":2' in subscription.queue.get_nowait()
+    assert subscription.queue.empty()
+
+
+def test_broadcast_stream_subscribes_when_started():
+    broadcast_hub = BroadcastHub()
+
+    async def run():
+        # Never started, as when the client leaves before the body is sent.
+        broadcast_hub.stream([1])
+        assert broadcast_hub.stats()["subscribers"] == 0
+        stream = broadcast_hub.stream([1])
+        assert await stream.__anext__() == b"retry: 3000\n\n"
+        assert broadcast_hub.stats()["subscribers"] == 1
+        await stream.aclose()
+        assert broadcast_hub.stats()["subscribers"] == 0
+
+    asyncio.run(run())
+
+
+def test_archived_month_in_stats():
+    month = {"station_id": 1, "date_from": "2001-01-01T00:00:00", "date_to": "2001-01-31T23:59:59"}
+    before = client.post("/stats/get_summary", data=json.dumps(month)).json()["value"]
+    sales = [
+        {"number": "A002AA", "fuel_quantity": 10, "station_id": 1, "date": "2001-01-10T08:15:00"},
+        {"number": "A002AA", "fuel_quantity": 20, "station_id": 1, "date": "2001-01-20T18:45:00"},
+    ]
+    client.post("/transactions/add_batch", data=json.dumps({"transactions": sales}))
+    assert asyncio.run(archive_month(engine, datetime.datetime(2001, 1, 1))) == 2
+    after = client.post("/stats/get_summary", data=json.dumps(month)).json()["value"]
+    assert after["count"] == before["count"] + 2
+    assert after["fuel"] == before["fuel"] + 30
+    fuel = client.post("/stats/get_all_fuel", data=json.dumps(month)).json()["value"]
+    assert fuel == after["fuel"]
+    # Unbounded, the archived month comes from its stored stats.
+    station = client.post("/stats/get_summary", data=json.dumps({"station_id": 1})).json()["value"]
+    live = client.post("/stats/get_summary", data=json.dumps({"station_id": 1, "date_from": "2001-02-01T00:00:00"}))
+    assert station["count"] == live.json()["value"]["count"] + after["count"]
+    assert station["p50"] is not None
+
+
+def test_rebuild_rollups_with_live_rows_in_archived_month():
+    station_id = add_station()
+    month = {"station_id": station_id, "date_from": "2002-03-01T00:00:00", "date_to": "2002-03-31T23:59:59"}
+    archived = {"number": "A003AA", "fuel_quantity": 10, "station_id": station_id, "date": "2002-03-05T08:15:00"}
+    client.post("/transactions/add_batch", data=json.dumps({"transactions": [archived]}))
+    # Earlier runs leave live rows of other stations in this month.
+    assert asyncio.run(archive_month(engine, datetime.datetime(2002, 3, 1))) >= 1
+    # A back-dated sale in the same hour, and one written without its rollup like seed does.
+    late = {**archived, "fuel_quantity": 20, "date": "2002-03-05T08:45:00"}
+    client.post("/transactions/add_batch", data=json.dumps({"transactions": [late]}))
+
+    async def rebuild():
+        async with async_session() as session:
+            sale = {"number": "A003AA", "fuel_quantity": 30, "fuel_type": 1, "price": 100, "station_id": station_id}
+            await session.execute(insert(Transaction).values(date=datetime.datetime(2002, 3, 6, 9), **sale))
+            await session.commit()
+            return await Transaction.rebuild_rollups(session)
+
+    result = asyncio.run(rebuild())
+    assert not result.is_error, result.error_desc
+    assert client.post("/stats/get_all_fuel", data=json.dumps(month)).json()["value"] == 60
+
+
+def test_failed_rearchive_keeps_archive_file(monkeypatch):
+    station_id = add_station()
+    month = datetime.datetime(2004, 6, 1)
+    sale = {"number": "A006AA", "fuel_quantity": 10, "station_id": station_id, "date": "2004-06-03T10:00:00"}
+
+    def add_sale():
+        client.post("/transactions/add_batch", data=json.dumps({"transactions": [sale]}))
+
+    async def archived():
+        async with async_session() as session:
+            months = await ArchivedMonth.overlapping(session, month, month)
+        return months, list(ArchivedMonth.scan(months, station_ids=[station_id]))
+
+    add_sale()
+    asyncio.run(archive_month(engine, month))
+    (first,), rows = asyncio.run(archived())
+    assert len(rows) == 1
+
+    def fail(*args):
+        raise RuntimeError("stats insert failed")
+
+    add_sale()
+    monkeypatch.setattr("archive.archived_stats", fail)
+    with pytest.raises(RuntimeError):
+        asyncio.run(archive_month(engine, month))
+    (current,), rows = asyncio.run(archived())
+    # The old file and its row are untouched, the new sale is still live.
+    assert current.path == first.path and len(rows) == 1
+    files = [name for name in os.listdir(os.path.dirname(first.path)) if name.startswith("transactions-2004-06")]
+    assert files == [os.path.basename(first.path)]
+
+    monkeypatch.undo()
+    asyncio.run(archive_month(engine, month))
+    (current,), rows = asyncio.run(archived())
+    assert len(rows) == 2
+    assert current.path != first.path and not os.path.exists(first.path)
+
+
+def test_analytics_matches_sql():
+    pytest.importorskip("numpy")
+    analytics = TransactionAnalytics()
+    assert asyncio.run(analytics.refresh()) > 0
+    # Station 2 has no archived sales, so SQL percentiles are exact.
+    summary = client.post("/stats/get_summary", data=json.dumps({"station_id": 2})).json()["value"]
+    value = analytics.summary(2)
+    assert value["count"] == summary["count"]
+    assert abs(value["p90"] - summary["p90"]) < 1e-6
+    groups = {group["station_id"]: group for group in analytics.group_by("station_id")}
+    assert groups[2]["count"] == summary["count"]
+    assert asyncio.run(analytics.refresh()) == 0
+
+
+
+def test_analytics_loads_late_commits():
+    pytest.importorskip("numpy")
+    station_id = add_station()
+    analytics = TransactionAnalytics()
+    asyncio.run(analytics.refresh())
+
+    async def add_sale(transaction_id: int):
+        async with async_session() as session:
+            sale = {"number": "125XFS", "fuel_quantity": 10, "fuel_type": 1, "price": 100, "station_id": station_id}
+            await session.execute(insert(Transaction).values(id=transaction_id, date=datetime.datetime.now(), **sale))
+            await session.commit()
+
+    # The higher id commits first, as a concurrent insert can on Postgres.
+    late_id = analytics.last_id + 1
+    asyncio.run(add_sale(late_id + 1))
+    assert asyncio.run(analytics.refresh()) == 1
+    asyncio.run(add_sale(late_id))
+    assert asyncio.run(analytics.refresh()) == 1
+    assert analytics.summary(station_id)["count"] == 2
+    assert asyncio.run(analytics.refresh()) == 0
+
+
+def test_group_by_rejects_bad_percentiles():
+    response = client.post("/stats/group_by", data=json.dumps({"percentiles": [0.5, 1.5]}))
+    assert response.status_code == 422
+
+
+def assert_max_queries(response, limit: int):
+    queries = int(response.headers["x-db-queries"])
+    request = response.request
+    assert queries <= limit, f"{request.method} {request.url.path}: {queries} queries, budget {limit}"
+
+
+def test_query_budgets():
+    sale = json.dumps({"number": "125XFS", "fuel_quantity": 1, "station_id": 1})
+    assert_max_queries(client.post("/transactions/add", data=sale), 4)
+    price = client.get("/fuel_types/get_by_id/1").json()["value"]["price"]
+    update = json.dumps({"fuel_type": 1, "new_price": price})
+    assert_max_queries(client.put("/fuel_types/update_price", data=update), 1)
+    assert_max_queries(client.get("/stations/get_all"), 1)
+    assert_max_queries(client.get("/stations/get_by_id/1"), 1)
+    assert_max_queries(client.get("/fuel_types/get_all"), 1)
+    assert_max_queries(client.get("/transactions/get_all"), 1)
+    assert_max_queries(client.post("/stats/get_summary", data=json.dumps({"station_id": 2})), 1)
+    assert_max_queries(client.get("/stats/get_median_price/2"), 1)
+
+
+def test_prepare_database_is_idempotent(tmp_path):
+    fresh = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fresh.sqlite3'}")
+
+    async def prepare_twice():
+        first = await prepare_database(fresh)
+        second = await prepare_database(fresh)
+        async with fresh.connect() as conn:
+            stations = (await conn.execute(select(func.count()).select_from(Station))).scalar()
+        await fresh.dispose()
+        return first, second, stations
+
+    (applied, seeded), second, stations = asyncio.run(prepare_twice())
+    assert applied and seeded
+    assert second == ([], False)
+    assert stations == 4
+
+
+def test_slow_query_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 0)
+    monkeypatch.setattr(slow_query_log, "path", str(tmp_path / "slow.jsonl"))
+    monkeypatch.setattr(slow_query_log, "shapes", {})
+    monkeypatch.setattr(slow_query_log, "_logger", None)
+    client.get("/stations/get_by_id/1")
+    client.get("/stations/get_by_id/2")
+    records = [json.loads(line) for line in (tmp_path / "slow.jsonl").read_text().splitlines()]
+    assert len(records) == 2
+    assert records[0]["method"] == "models/station.py:Station.get_by_id"
+    assert records[0]["route"] == "GET /stations/get_by_id/1"
+    assert records[0]["plan"]
+    assert "plan" not in records[1]
+    response = client.get("/admin/slow_queries")
+    assert response.json()["code"] == 200
+    assert response.json()["value"][0]["count"] == 2
+    assert statement_shape("SELECT 1 WHERE id IN ($1, $2, $3)") == statement_shape("SELECT 1 WHERE id IN (?)")
+
+
+def test_migrate_backfills_rollups(tmp_path):
+    old = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.sqlite3'}")
+    sales = [
+        {"number": "A001AA", "fuel_quantity": 10.0, "fuel_type": 1, "price": 430.0, "date": datetime.datetime(2020, 5, 1, 9, 10), "station_id": 1},
+        {"number": "A001AA", "fuel_quantity": 20.0, "fuel_type": 1, "price": 860.0, "date": datetime.datetime(2020, 5, 1, 11, 40), "station_id": 1},
+    ]
+
+    async def upgrade_old_database():
+        # Sales written before hourly_rollups was maintained.
+        async with old.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(Transaction), sales)
+        await prepare_database(old)
+        async with AsyncSession(old) as session:
+            result = await Transaction.get_totals(
+                session, 1, datetime.datetime(2020, 5, 1), datetime.datetime(2020, 5, 2)
+            )
+        await old.dispose()
+        return result.value
+
+    totals = asyncio.run(upgrade_old_database())
+    assert totals["count"] == 2
+    assert totals["fuel"] == 30
@@ -0,0 +1,28 @@
+import time
+
+
+# pylint: disable=C0115,C0116
+class TableVersions:
+    """Per-table change counters behind the ETags of cached reads.
+
+    Model methods bump a table after committing a change to it. The
+    counters live in this process only, so the ETag also carries the
+    process start time: a restart never reuses an old tag. Changes made
+    by other processes (seeding, other workers) are not seen here.
+    """
+
+    def __init__(self):
+        self.epoch = format(time.time_ns(), "x")
+        self._versions: dict[str, int] = {}
+
+    def bump(self, table: str):
+        self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(self, table: str) -> int:
+        return self._versions.get(table, 0)
+
+    def etag(self, *tables: str) -> str:
+        return f'W/"{self.epoch}-' + "-".join(str(self.get(table)) for table in tables) + '"'
+
+
+table_versions = TableVersions()
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from db import DbResult, async_session
+from models.transaction import Transaction
+from versions import table_versions
+
+WRITE_BUFFER = os.environ.get("WRITE_BUFFER") == "1"
+WRITE_BUFFER_INTERVAL_MS = float(os.environ.get("WRITE_BUFFER_INTERVAL_MS", "5"))
+WRITE_BUFFER_MAX_ROWS = int(os.environ.get("WRITE_BUFFER_MAX_ROWS", "200"))
+
+
+# pylint: disable=C0115,C0116,W0718
+class SaleWriteBuffer:
+    """Group commit for sales.
+
+    Callers queue a sale and wait on a future. A flush runs every queued
+    sale through Transaction._dispense on one session and commits once,
+    either interval_ms after the first sale arrived or as soon as
+    max_rows sales are waiting. Each future then resolves with that
+    sale's DbResult, so callers see the same results as with
+    Transaction.dispense. _dispense rolls a rejected sale back to its
+    own savepoint, so the commit only holds the accepted ones.
+    """
+
+    def __init__(self, interval_ms: float = WRITE_BUFFER_INTERVAL_MS, max_rows: int = WRITE_BUFFER_MAX_ROWS):
+        self.interval_ms = interval_ms
+        self.max_rows = max_rows
+        self.flushes = 0
+        self.rows = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+
+    def stats(self) -> dict:
+        return {
+            "interval_ms": self.interval_ms,
+            "max_rows": self.max_rows,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows": self.rows,
+            "errors": self.errors,
+            "avg_batch": self.rows / self.flushes if self.flushes else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    async def dispense(self, number: str, station_id: int, fuel_quantity: float) -> DbResult:
+        self.start()
+        future = self._loop.create_future()
+        self._pending.append(((number, station_id, fuel_quantity), future))
+        self._ready.set()
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return await future
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._pending:
+            await self._flush()
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+
+    async def _flush(self):
+        batch = self._pending[:self.max_rows]
+        self._pending = self._pending[self.max_rows:]
+        if len(self._pending) < self.max_rows:
+            self._full.clear()
+        if not self._pending:
+            self._ready.clear()
+        if not batch:
+            return
+
+        start = time.perf_counter()
+        results = []
+        try:
+            async with async_session() as session:
+                try:
+                    for args, _ in batch:
+                        results.append(await Transaction._dispense(session, *args))
+                    await session.commit()
+                    table_versions.bump("stations")
+                except Exception:
+                    await session.rollback()
+                    raise
+        except Exception as e:
+            self.errors += 1
+            results = [DbResult.error(str(e), 500)] * len(batch)
+        self.flushes += 1
+        self.rows += len(batch)
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+sale_write_buffer = SaleWriteBuffer()